@@ -0,0 +1,354 @@
+"""
+Benchmarks the analysis of the rough lock with ramps recorded in the lab.
+
+Every ramp of the given logs is passed through `find_slope`, `fit_line`,
+`determine_target_mode` and the fitting helpers. Latency, throughput and
+peak memory are reported per function. The fits are compared to the fits
+that were accepted during the recorded run. Additionally, the time for
+importing the tuner in a fresh interpreter is checked against a budget.
+
+Usage:
+
+    python benchmark.py LOG [LOG ...] [--baseline FILE] [--save-baseline]
+"""
+import io
+import sys
+import json
+import argparse
+import subprocess
+import tracemalloc
+import numpy as np
+from os import path as os_path
+from time import perf_counter
+from types import SimpleNamespace
+from contextlib import redirect_stdout
+from config import CURRENT_LIMITS
+from utils import fit_line, NotReachable, line
+from fitting import segment_ramp, find_mode_window, fit_windows
+from log_file import read_log, LogReader
+from rough_lock import RoughLock, MAX_FIT_ERROR
+
+BASELINE_FILENAME = 'benchmark_baseline.json'
+# target frequencies of old JSON logs that don't store them
+DEFAULT_TARGET_FREQUENCIES = [2.4e9, 4.4e9]
+# a function is flagged if it is this much slower than in the baseline
+MAX_SLOWDOWN = 1.25
+# ... and if the difference is larger than the timing noise
+MIN_SLOWDOWN = 50e-6 # s per ramp
+# a fit agrees with the accepted fit if the frequencies at the center of the
+# fitted interval differ by less than this
+MAX_FREQUENCY_DEVIATION = 50e6 # Hz
+REPEAT = 5
+# importing the tuner (without debugging) has to be faster than this and
+# must not load any of the heavy modules
+IMPORTED_MODULES = ['control', 'rough_lock', 'utils', 'fitting']
+IMPORT_BUDGET = 0.5 # s
+HEAVY_MODULES = ['matplotlib', 'seaborn', 'scipy', 'plumbum']
+
+
+class QuietRoughLock(RoughLock):
+    """
+    A `RoughLock` that is only used for analysing data, it doesn't log.
+    """
+    def log(self, item):
+        pass
+
+
+def load_corpus(log_filenames, target_frequencies=DEFAULT_TARGET_FREQUENCIES):
+    """
+    Returns a list of `(target_frequencies, curr, freq, accepted)` for every
+    ramp of the logs. `accepted` is `(slope, shift, curr_interval)` of the fit
+    that was accepted in the recorded run, or None if no mode was found.
+    """
+    corpus = []
+
+    for log_filename in log_filenames:
+        entries = read_log(log_filename)
+
+        targets = target_frequencies
+        if isinstance(entries, LogReader):
+            targets = entries.meta().get('target_frequencies', targets)
+
+        for item in entries:
+            if isinstance(item, str):
+                continue
+
+            if len(item) == 2:
+                curr, freq = item
+                accepted = None
+            else:
+                curr, freq, curr_interval, slope, shift = item
+                accepted = (slope, shift, np.asarray(curr_interval, dtype=float))
+
+            corpus.append((
+                targets, np.asarray(curr, dtype=float),
+                np.asarray(freq, dtype=float), accepted
+            ))
+
+    return corpus
+
+
+def rough_lock_for(target_frequencies):
+    fc = SimpleNamespace(
+        target_frequencies=target_frequencies,
+        start_current=np.mean(CURRENT_LIMITS),
+        mode_cache=None,
+        hop_strategy=None,
+        name=None,
+    )
+    return QuietRoughLock(fc)
+
+
+def benchmark_functions(rough_lock):
+    """
+    The benchmarked functions. All of them are called with
+    `(curr, freq, accepted)`.
+    """
+    def determine_target_mode(curr, freq, accepted):
+        if accepted is None:
+            return
+        try:
+            return rough_lock.determine_target_mode(*accepted[:2])
+        except NotReachable:
+            return
+
+    return {
+        'find_slope': lambda curr, freq, accepted:
+            rough_lock.find_slope(curr, freq),
+        'fit_line': lambda curr, freq, accepted: fit_line(curr, freq),
+        'determine_target_mode': determine_target_mode,
+        'segment_ramp': lambda curr, freq, accepted: segment_ramp(curr, freq),
+        'find_mode_window': lambda curr, freq, accepted: find_mode_window(
+            curr, freq, rough_lock.is_good_slope, MAX_FIT_ERROR
+        ),
+        'fit_windows': lambda curr, freq, accepted: fit_windows(curr, freq),
+    }
+
+
+def _prepare(corpus):
+    """
+    Returns the benchmarked functions for every ramp of the corpus.
+    """
+    functions = {}
+    for targets, _, _, _ in corpus:
+        key = tuple(targets)
+        if key not in functions:
+            functions[key] = benchmark_functions(rough_lock_for(targets))
+    return [functions[tuple(targets)] for targets, _, _, _ in corpus]
+
+
+def _run(corpus, functions, name):
+    """
+    Calls the function `name` for every ramp of the corpus and returns the
+    results.
+    """
+    return [
+        f[name](curr, freq, accepted)
+        for f, (_, curr, freq, accepted) in zip(functions, corpus)
+    ]
+
+
+def measure_performance(corpus, repeat=REPEAT):
+    """
+    Returns a dict mapping function names to latency per ramp (best of
+    `repeat` runs), throughput and peak memory.
+    """
+    performance = {}
+    functions = _prepare(corpus)
+
+    for name in functions[0]:
+        durations = []
+        for i in range(repeat):
+            start = perf_counter()
+            _run(corpus, functions, name)
+            durations.append(perf_counter() - start)
+
+        tracemalloc.start()
+        _run(corpus, functions, name)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        best = min(durations)
+        performance[name] = {
+            'latency': best / len(corpus),
+            'throughput': len(corpus) / best,
+            'peak_memory': peak,
+        }
+
+    return performance
+
+
+def measure_accuracy(corpus):
+    """
+    Compares the results of `find_slope` to the accepted fits of the
+    recorded run.
+    """
+    found = _run(corpus, _prepare(corpus), 'find_slope')
+
+    agree = missed = new = 0
+    slope_errors = []
+
+    for (targets, curr, freq, accepted), data in zip(corpus, found):
+        if accepted is None:
+            new += data is not None
+            continue
+
+        if data is None:
+            missed += 1
+            continue
+
+        slope, shift, curr_interval = accepted
+        center = np.mean(curr_interval) if len(curr_interval) else np.mean(curr)
+        deviation = np.abs(
+            line(center, data[3], data[4]) - line(center, slope, shift)
+        )
+        agree += deviation < MAX_FREQUENCY_DEVIATION
+        slope_errors.append(np.abs((data[3] - slope) / slope))
+
+    n_accepted = sum(accepted is not None for _, _, _, accepted in corpus)
+
+    return {
+        'ramps': len(corpus),
+        'accepted': n_accepted,
+        'agreement': agree / n_accepted if n_accepted else 1.,
+        'missed': missed,
+        'new_modes': new,
+        'median_slope_error': float(np.median(slope_errors))
+        if slope_errors else 0.,
+    }
+
+
+def measure_imports(modules=IMPORTED_MODULES):
+    """
+    Imports `modules` in a fresh interpreter and returns the import time
+    and the heavy modules that were loaded.
+    """
+    script = '\n'.join([
+        'import sys, json',
+        'from time import perf_counter',
+        'start = perf_counter()',
+        'import %s' % ', '.join(modules),
+        'duration = perf_counter() - start',
+        'heavy = [m for m in %r if m in sys.modules]' % HEAVY_MODULES,
+        'print(json.dumps({"time": duration, "heavy_modules": heavy}))',
+    ])
+    output = subprocess.check_output(
+        [sys.executable, '-c', script],
+        cwd=os_path.dirname(os_path.abspath(__file__))
+    )
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def check_imports(imports):
+    """
+    Returns a list of violations of the import budget.
+    """
+    problems = []
+    if imports['time'] > IMPORT_BUDGET:
+        problems.append('import takes %.2fs, budget %.2fs' % (
+            imports['time'], IMPORT_BUDGET
+        ))
+    for module in imports['heavy_modules']:
+        problems.append('importing the tuner loads %s' % module)
+    return problems
+
+
+def compare_to_baseline(results, baseline):
+    """
+    Returns a list of regressions compared to the baseline.
+    """
+    regressions = []
+
+    for name, performance in results['performance'].items():
+        reference = baseline['performance'].get(name)
+        if reference is None:
+            continue
+        latency, reference_latency = performance['latency'], reference['latency']
+        if latency > MAX_SLOWDOWN * reference_latency and \
+                latency - reference_latency > MIN_SLOWDOWN:
+            regressions.append('%s: %.3fms per ramp, baseline %.3fms' % (
+                name, latency * 1e3, reference_latency * 1e3
+            ))
+
+    agreement = results['accuracy']['agreement']
+    reference = baseline['accuracy']['agreement']
+    if agreement < reference:
+        regressions.append('agreement with accepted fits: %.3f, baseline %.3f' % (
+            agreement, reference
+        ))
+
+    return regressions
+
+
+def run_benchmark(log_filenames, target_frequencies=DEFAULT_TARGET_FREQUENCIES,
+                  repeat=REPEAT):
+    corpus = load_corpus(log_filenames, target_frequencies)
+    if not corpus:
+        raise ValueError('the logs contain no ramps')
+
+    # find_slope prints every slope it finds
+    with redirect_stdout(io.StringIO()):
+        return {
+            'performance': measure_performance(corpus, repeat),
+            'accuracy': measure_accuracy(corpus),
+            'imports': measure_imports(),
+        }
+
+
+def format_results(results):
+    lines = ['%-25s %12s %12s %12s' % (
+        'function', 'ms/ramp', 'ramps/s', 'peak kB'
+    )]
+    for name, performance in results['performance'].items():
+        lines.append('%-25s %12.3f %12.1f %12.1f' % (
+            name, performance['latency'] * 1e3, performance['throughput'],
+            performance['peak_memory'] / 1e3
+        ))
+    lines.append('')
+    for key, value in results['accuracy'].items():
+        lines.append('%-25s %12s' % (key, value))
+    lines.append('')
+    lines.append('%-25s %12.3f' % ('import time/s', results['imports']['time']))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('logs', nargs='+')
+    parser.add_argument('--baseline', default=BASELINE_FILENAME)
+    parser.add_argument(
+        '--save-baseline', action='store_true',
+        help='store the results as the new baseline'
+    )
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument(
+        '--targets', nargs=2, type=float, default=DEFAULT_TARGET_FREQUENCIES,
+        help='target frequencies for old JSON logs'
+    )
+    args = parser.parse_args()
+
+    results = run_benchmark(args.logs, args.targets, args.repeat)
+    print(format_results(results))
+
+    problems = check_imports(results['imports'])
+    for problem in problems:
+        print('IMPORT BUDGET', problem)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        try:
+            with open(args.baseline, 'r') as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            baseline = None
+
+        if baseline is not None:
+            regressions = compare_to_baseline(results, baseline)
+            for regression in regressions:
+                print('REGRESSION', regression)
+            problems += regressions
+
+    if problems:
+        raise SystemExit(1)
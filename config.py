@@ -29,5 +29,9 @@ MEASUREMENT_TIME = REDPITAYA_DATA_POINTS / MEASUREMENT_RATE
 FREQ_MEASUREMENT_RATE = MEASUREMENT_RATE / SCALING / SKIP_POINTS
 FREQ_MEASUREMENT_TIME = MEASUREMENT_TIME / SCALING
 
+# the beat frequency is considered settled if consecutive readings differ
+# by less than this
+SETTLE_TOLERANCE = 50e6 # Hz
+
 # which modes should be considered?
 DELTA_MODES = [0, 1, -1, 2, -2, 3, -3]
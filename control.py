@@ -1,15 +1,12 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 import numpy as np
-from time import sleep, time
-from matplotlib import pyplot as plt
-from ben.devices import Meerstetter, connect_to_device_service, RedPitaya, \
-    DLLException, SeperateProcess
-from plumbum import colors
-from utils import TemperatureOutOfBounds, replay
+from time import time
+from utils import TemperatureOutOfBounds, dim
 from lock import Lock
 from config import CURRENT_LIMITS
 from rough_lock import RoughLock
+from tracing import traced
 
 
 class FrequencyControl:
@@ -20,7 +17,7 @@ class FrequencyControl:
     Usage:
 
         fctl = FrequencyControl(
-            TBusElectronics, # electronics module
+            TBusElectronics, # electronics class (or factory)
             [1e8, 1.05e8], # the desired offset frequencies
             100, # the MO current at start
             24, # the temperature at start,
@@ -34,19 +31,41 @@ class FrequencyControl:
 
     This class is mainly for housekeeping.
     The algorithm is within `RoughLock`.
+
+    In order to issue commands to different instruments concurrently, wrap
+    the electronics in `PipelinedElectronics`. `CachingElectronics` avoids
+    redundant reads and writes. For timing every phase and device call, wrap
+    the electronics in `TracedElectronics` and call `enable_tracing`.
+
+    If a `ModeCache` is given, the rough lock starts from a recently fitted
+    mode instead of searching for it.
+
+    The rough lock learns how far the MO current has to be moved in order to
+    force a mode hop. Pass a `HopStrategy` in order to share this knowledge
+    between several runs.
+
+    If several lasers are tuned at the same time, give each of them a `name`
+    that distinguishes their logs.
     """
     def __init__(self, electronics, target_frequencies, start_current,
-                 start_temperature, debug=False):
+                 start_temperature, debug=False, mode_cache=None,
+                 hop_strategy=None, name=None):
+        self.name = name
         self.target_frequencies = target_frequencies
         self.start_current = start_current
         self.start_temperature = start_temperature
         self.debug = debug
+        self.mode_cache = mode_cache
+        self.hop_strategy = hop_strategy
 
         self.electronics = electronics()
+        if mode_cache is not None and mode_cache.clock is None:
+            mode_cache.clock = self.electronics.time
         self.rough_lock = RoughLock(self)
 
         self._vhbg_target_temperature = self.electronics.get_vhbg_target_temperature()
 
+    @traced('frequency_control.prepare')
     def prepare(self):
         """
         Set initial current and temperature, initialize current ramp.
@@ -59,7 +78,7 @@ class FrequencyControl:
         self.electronics.prepare_ramp_measurement()
         self.laser_current = self.start_current
 
-        sleep(5)
+        self.electronics.wait_for_stable_frequency(5)
 
         self.electronics.wait_for_stable_temperatures()
 
@@ -67,10 +86,11 @@ class FrequencyControl:
         # this ensures that for the same parameters, we always start in the same mode
         # this is not necessary for the algorithm, but good for reliability tests
         self.laser_current = CURRENT_LIMITS[0]
-        sleep(.5)
+        self.electronics.wait_for_stable_frequency(.5)
         self.laser_current = self.start_current
-        sleep(3)
+        self.electronics.wait_for_stable_frequency(3)
 
+    @traced('frequency_control.do_rough_lock')
     def do_rough_lock(self):
         """
         Perform a rough lock such that the two desired beat frequencies are within
@@ -81,17 +101,20 @@ class FrequencyControl:
         self.electronics.stop_ramp()
         return N_temp_changes, N_wiggles
 
+    @traced('frequency_control.do_lock')
     def do_lock(self):
         """
         Turn on the real lock.
         """
         def _check_lock(frequency):
             self.electronics.lock(frequency)
-            sleep(1)
+            self.electronics.sleep(1)
             _, frequencies = self.electronics.measure_frequencies(100)
             diffs = [np.abs(f - frequency) for f in frequencies]
-            plt.plot(frequencies)
-            plt.show()
+            if self.debug:
+                from matplotlib import pyplot as plt
+                plt.plot(frequencies)
+                plt.show()
             assert np.max(diffs) < 100e6
 
         _check_lock(self.target_frequencies[0])
@@ -103,16 +126,21 @@ class FrequencyControl:
         self.rough_lock.cleanup()
 
         if self.debug:
+            from plotting import replay
             print('------------ REPLAY ------------')
             replay(self.target_frequencies, self.rough_lock.log_entries)
 
+    def _log_setting(self, text):
+        # colouring the console output loads plumbum, only do it when debugging
+        self.rough_lock.log(dim(text) if self.debug else text)
+
     @property
     def vhbg_target_temperature(self):
         return self._vhbg_target_temperature
 
     @vhbg_target_temperature.setter
     def vhbg_target_temperature(self, temperature):
-        self.rough_lock.log(colors.dim | ('vhbg=%.2f°' % temperature))
+        self._log_setting('vhbg=%.2f°' % temperature)
         self.electronics.set_vhbg_target_temperature(temperature)
         self._vhbg_target_temperature = temperature
 
@@ -122,12 +150,13 @@ class FrequencyControl:
 
     @laser_current.setter
     def laser_current(self, current):
-        self.rough_lock.log(colors.dim | ('current=%.2fmA' % current))
+        self._log_setting('current=%.2fmA' % current)
         self.electronics.set_laser_current(current)
         self._laser_current = current
 
 
 if __name__ == '__main__':
+    from plumbum import colors
     from ben.frequency_control.electronics.ilx_rp_cnt90 import ILXRedPitayaCnt90Electronics
     from ben.frequency_control.electronics.tbus import TBusElectronics
 
@@ -1,14 +1,30 @@
 from ben.devices import connect_to_device_service, RedPitaya, SeperateProcess, Meerstetter
 import numpy as np
 from time import time, sleep
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from ben.frequency_control.config import RAMP_FREQUENCY, RAMP_AMPLITUDE, DECIMATION_FACTOR, \
     FREQ_MEASUREMENT_TIME, FREQ_MEASUREMENT_RATE, SKIP_POINTS, \
-    CURRENT_MOD_FACTOR
-from ben.frequency_control.utils import find_negative_ramp, wait_for_stable_temperature
+    CURRENT_MOD_FACTOR, MEASUREMENT_TIME
+from ben.frequency_control.utils import find_ramps, wait_for_stable_temperature, \
+    NoRamp, print_remaining_time
+
+# number of frequencies recorded by the counter during one acquisition
+COUNTER_POINTS = int(FREQ_MEASUREMENT_TIME * FREQ_MEASUREMENT_RATE)
+# newer Red Pitaya servers can return a decimated window of the buffer
+# (`read_buffer(start, stop, step)`). The deployed one only returns the whole
+# buffer, i.e. this has to be enabled explicitly.
+WINDOWED_READOUT = False
+# how long to wait for a trigger after the acquisition should have finished
+TRIGGER_TIMEOUT = 0.5 # s
+# every poll is a request to the Red Pitaya. Most of the acquisition is slept
+# through anyway, i.e. a finer interval hardly shortens the measurement.
+TRIGGER_POLL_INTERVAL = 0.01 # s
 
 
 class ILXRedPitayaCnt90Electronics:
     _ramp_started = False
+    # counter transfer of an aborted measurement that was still running
+    _pending_transfer = None
 
     def __init__(self):
         self.ilx = connect_to_device_service('192.168.1.177', 'ilx')
@@ -24,7 +40,16 @@ class ILXRedPitayaCnt90Electronics:
 
         self.vhbg.parameters['COARSE_TEMP_RAMP'] = 1.5
         self.vhbg.parameters['PROXIMITY_WIDTH'] = 0
+
+        self.windowed_readout = WINDOWED_READOUT
+        self._counter_executor = ThreadPoolExecutor(1)
     
+    def time(self):
+        return time()
+
+    def sleep(self, duration):
+        sleep(duration)
+
     def get_vhbg_temperature(self):
         return self.vhbg.get_temperature()
     
@@ -36,9 +61,23 @@ class ILXRedPitayaCnt90Electronics:
     
     def wait_for_stable_temperatures(self):
         print('warte auf stabile VHBG-Temperatur')
-        wait_for_stable_temperature(self.vhbg, 0.005)
+        wait_for_stable_temperature(
+            self.vhbg, 0.005, sleep=self.sleep, now=self.time,
+            report=print_remaining_time
+        )
         print('warte auf stabile MIOB-Temperatur')
-        wait_for_stable_temperature(self.miob, 0.001)
+        wait_for_stable_temperature(
+            self.miob, 0.001, sleep=self.sleep, now=self.time,
+            report=print_remaining_time
+        )
+
+    def wait_for_stable_frequency(self, max_duration):
+        """
+        The counter is armed for the next ramp measurement and can't be used
+        for intermediate readings. Therefore, we just wait.
+        """
+        self.sleep(max_duration)
+        return max_duration
 
     def set_laser_current(self, current):
         self.ilx.root.set_laser_current(current)
@@ -58,6 +97,14 @@ class ILXRedPitayaCnt90Electronics:
 
             sleep(0.1)
 
+        if self._pending_transfer is not None:
+            # the counter can't be armed before it has returned its data
+            try:
+                self._pending_transfer.result()
+            except Exception:
+                pass
+            self._pending_transfer = None
+
         self.redpitaya.set_acquisition_trigger(
             'CH2_PE', decimation=DECIMATION_FACTOR, delay=8192 + 900
         )
@@ -73,18 +120,76 @@ class ILXRedPitayaCnt90Electronics:
     def _set_trigger(self, value):
         self.trigger_out.set_constant_voltage(1 if value else 0)
 
-    def measure_frequencies(self, center_current):
-        t1 = time()
-        ramp_in = self.redpitaya.fast_in[0]
+    def ramp_current_range(self, center_current):
+        return center_current - RAMP_AMPLITUDE * CURRENT_MOD_FACTOR, \
+            center_current + RAMP_AMPLITUDE * CURRENT_MOD_FACTOR
 
-        self._set_trigger(True)
+    def _wait_for_trigger(self, deadline):
+        """
+        Waits until the Red Pitaya was triggered. The acquisition takes
+        `MEASUREMENT_TIME` anyway, therefore we sleep most of it before
+        polling. Raises `NoRamp` if there is no trigger until `deadline`.
+        """
+        self.sleep(max(min(MEASUREMENT_TIME, deadline - self.time()), 0))
 
         while not self.redpitaya.was_triggered():
-            print('not triggered')
-            sleep(0.01)
+            if self.time() > deadline:
+                raise NoRamp()
+            self.sleep(TRIGGER_POLL_INTERVAL)
+
+    def _read_ramp(self):
+        """
+        Reads the decimated part of the Red Pitaya buffer that is covered by
+        the counter measurement.
+        """
+        ramp_in = self.redpitaya.fast_in[0]
+
+        if self.windowed_readout:
+            return np.array(ramp_in.read_buffer(
+                start=0, stop=COUNTER_POINTS * SKIP_POINTS, step=SKIP_POINTS
+            ))
 
-        ramp = ramp_in.read_buffer()[::SKIP_POINTS]
-        frequencies = list(self.counter.root.wait_and_return())
+        return np.array(ramp_in.read_buffer()[::SKIP_POINTS])
+
+    def measure_frequencies(self, center_current, estimator=None):
+        """
+        Records a ramp. The counter returns all frequencies at once, i.e.
+        an `estimator` is only fed with the complete ramp.
+
+        All complete flanks are returned in the order of the acquisition,
+        i.e. the current runs down and up again. `segment_ramp` detects
+        hops on the step size relative to the current step, so the turning
+        points aren't hops and a mode is fitted on both flanks.
+        """
+        deadline = self.time() + MEASUREMENT_TIME + TRIGGER_TIMEOUT
+
+        self._set_trigger(True)
+        # the counter transfers its data while we read the Red Pitaya
+        counter_result = self._counter_executor.submit(
+            self.counter.root.wait_and_return
+        )
+
+        try:
+            self._wait_for_trigger(deadline)
+            ramp = self._read_ramp()
+            frequencies = np.array(counter_result.result())
+        finally:
+            # do this after data acquiry because it causes a crosstalk on the
+            # other redpitaya channel
+            self._set_trigger(False)
+            # after an error, the pending counter transfer must not overlap
+            # with the next measurement
+            if not counter_result.cancel():
+                try:
+                    counter_result.result(
+                        timeout=max(deadline - self.time(), 0) + TRIGGER_TIMEOUT
+                    )
+                except TimeoutError:
+                    # still running, the next measurement waits for it
+                    self._pending_transfer = counter_result
+                except Exception:
+                    # the original error is more interesting
+                    pass
 
         """from matplotlib import pyplot as plt
         plt.plot(ramp)
@@ -92,18 +197,18 @@ class ILXRedPitayaCnt90Electronics:
         plt.plot(frequencies)
         plt.show()"""
 
-        # do this after data acquiry because it causes a crosstalk on the other
-        # redpitaya channel
-        self._set_trigger(False)
-
-        slice_ = find_negative_ramp(ramp)
+        # use falling and rising flanks of the ramp
+        flanks = find_ramps(ramp)
+        if not flanks:
+            raise NoRamp()
         # offset corrects a delay between redpitaya and counter triggering
         offset = 0
-        frequencies = np.array(frequencies[
-            slice(slice_.start + offset, slice_.stop + offset, slice_.step)
+        idxs = np.concatenate([
+            np.arange(slice_.start, slice_.stop) for slice_, _ in flanks
         ])
-        currents = np.array(ramp[slice_]) * CURRENT_MOD_FACTOR + \
-            center_current
+        idxs = idxs[(idxs + offset >= 0) & (idxs + offset < len(frequencies))]
+        frequencies = frequencies[idxs + offset]
+        currents = ramp[idxs] * CURRENT_MOD_FACTOR + center_current
 
         """print('SHIFTED')
         plt.plot(currents)
@@ -111,6 +216,9 @@ class ILXRedPitayaCnt90Electronics:
         plt.plot(frequencies)
         plt.show()"""
 
+        if estimator is not None:
+            estimator.add(currents, frequencies)
+
         return currents, frequencies
 
     def cleanup(self):
@@ -118,5 +226,6 @@ class ILXRedPitayaCnt90Electronics:
         sleep(0.5)
         self._set_trigger(False)
         self.miob.close()
+        self._counter_executor.shutdown()
         self.vhbg.parameters['COARSE_TEMP_RAMP'] = self._coarse_temp_ramp
         self.vhbg.parameters['PROXIMITY_WIDTH'] = self._proximity_width
\ No newline at end of file
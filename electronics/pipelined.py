@@ -0,0 +1,101 @@
+from concurrent.futures import ThreadPoolExecutor
+from ben.frequency_control.wrapper import ElectronicsWrapper
+
+# which instrument executes which command. Commands to different instruments
+# may run concurrently, commands to the same instrument are executed in order.
+INSTRUMENTS = {
+    'set_laser_current': 'ecdl',
+    'get_vhbg_temperature': 'vhbg',
+    'get_vhbg_target_temperature': 'vhbg',
+    'set_vhbg_target_temperature': 'vhbg',
+    'prepare_ramp_measurement': 'acquisition',
+    'measure_frequencies': 'acquisition',
+    'stop_ramp': 'acquisition',
+    'lock': 'acquisition',
+    'unlock': 'acquisition',
+}
+# commands without a return value don't block the caller
+ASYNC_COMMANDS = {
+    'set_laser_current', 'set_vhbg_target_temperature',
+    'prepare_ramp_measurement', 'stop_ramp',
+}
+# pending commands to these instruments have to be finished before the
+# command is executed
+DEPENDENCIES = {
+    'measure_frequencies': ['ecdl'],
+    'lock': ['ecdl'],
+}
+
+
+class PipelinedElectronics(ElectronicsWrapper):
+    """
+    Wraps an electronics backend and issues commands to different instruments
+    concurrently.
+
+    Only setters and commands without a return value are pipelined: they
+    return immediately, e.g. the VHBG target temperature is sent while the MO
+    current is being changed. `prepare_ramp_measurement` is one of them, so
+    the acquisition only overlaps the analysis of the previous ramp with
+    backends that arm a measurement there (ILX). With TBus it does nothing
+    after the first call and the ramp is read in `measure_frequencies`, which
+    blocks. A ramp measurement waits until the MO current has been applied. Sleeping, waiting for stable temperatures or
+    frequencies and any command that is unknown to this class wait for all
+    pending commands.
+
+    Errors of asynchronous commands are raised by the next command that waits
+    for the instrument.
+
+    Usage:
+
+        fctl = FrequencyControl(
+            lambda: PipelinedElectronics(TBusElectronics()),
+            ...
+        )
+    """
+    def __init__(self, backend):
+        super().__init__(backend)
+        self._executors = {
+            instrument: ThreadPoolExecutor(max_workers=1)
+            for instrument in set(INSTRUMENTS.values())
+        }
+        self._pending = {instrument: [] for instrument in self._executors}
+
+    def _flush(self, instruments=None):
+        """
+        Waits for all pending commands to the given instruments.
+        """
+        if instruments is None:
+            instruments = self._pending.keys()
+
+        for instrument in instruments:
+            pending = self._pending[instrument]
+            self._pending[instrument] = []
+            for future in pending:
+                future.result()
+
+    def _call(self, name, method, args, kwargs):
+        instrument = INSTRUMENTS.get(name)
+
+        if instrument is None:
+            self._flush()
+            return method(*args, **kwargs)
+
+        self._flush(DEPENDENCIES.get(name, []))
+
+        future = self._executors[instrument].submit(method, *args, **kwargs)
+
+        if name in ASYNC_COMMANDS:
+            self._pending[instrument].append(future)
+            return
+
+        # keep the order of errors: earlier commands fail first
+        self._flush([instrument])
+        return future.result()
+
+    def cleanup(self):
+        self._flush()
+        try:
+            return self.backend.cleanup()
+        finally:
+            for executor in self._executors.values():
+                executor.shutdown()
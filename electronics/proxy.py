@@ -0,0 +1,118 @@
+from ben.frequency_control.metrics import LatencyCounter
+from ben.frequency_control.wrapper import ElectronicsWrapper
+
+# reads without side effects and how long (in seconds) their results may be
+# reused. The VHBG target temperature only changes if we set it.
+CACHED_READS = {
+    'get_vhbg_target_temperature': float('inf'),
+    'get_vhbg_temperature': 0.2,
+}
+# setters whose call can be dropped if the value didn't change, and the read
+# that returns the value afterwards (or None)
+SETTERS = {
+    'set_laser_current': None,
+    'set_vhbg_target_temperature': 'get_vhbg_target_temperature',
+}
+# the results of these reads are outdated after calling the command
+INVALIDATES = {
+    'set_vhbg_target_temperature': ['get_vhbg_temperature'],
+    'wait_for_stable_temperatures': ['get_vhbg_temperature'],
+}
+
+
+class CachingElectronics(ElectronicsWrapper):
+    """
+    Wraps an electronics backend and reduces the number of round trips to
+    the devices.
+
+    Results of idempotent reads are reused for some time (`CACHED_READS`),
+    setters that would send the same value again are dropped. For every
+    method, round trips and their latency are counted in `latency`, cache
+    hits and dropped setters in `saved`.
+
+    All commands are assumed to go through this proxy. If a device is changed
+    from somewhere else, call `invalidate()`.
+
+    In order to also issue commands to different instruments concurrently,
+    wrap a `PipelinedElectronics`:
+
+        fctl = FrequencyControl(
+            lambda: CachingElectronics(PipelinedElectronics(TBusElectronics())),
+            ...
+        )
+    """
+    def __init__(self, backend):
+        super().__init__(backend)
+        self.latency = {}
+        self.saved = {}
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Forgets all cached values.
+        """
+        self._cache = {}
+        self._last_values = {}
+
+    def _call(self, name, method, args, kwargs):
+        if name in CACHED_READS and not args and not kwargs:
+            return self._read(name, method)
+
+        if name in SETTERS and len(args) == 1 and not kwargs:
+            return self._set(name, method, args[0])
+
+        return self._round_trip(name, method, args, kwargs)
+
+    def _round_trip(self, name, method, args, kwargs):
+        if name not in self.latency:
+            self.latency[name] = LatencyCounter(name)
+
+        with self.latency[name].timed():
+            result = method(*args, **kwargs)
+
+        for read in INVALIDATES.get(name, []):
+            self._cache.pop(read, None)
+
+        return result
+
+    def _save(self, name):
+        self.saved[name] = self.saved.get(name, 0) + 1
+
+    def _read(self, name, method):
+        now = self.backend.time()
+        cached = self._cache.get(name)
+
+        if cached is not None and now - cached[0] < CACHED_READS[name]:
+            self._save(name)
+            return cached[1]
+
+        value = self._round_trip(name, method, (), {})
+        self._cache[name] = (now, value)
+        return value
+
+    def _set(self, name, method, value):
+        if name in self._last_values and self._last_values[name] == value:
+            self._save(name)
+            return
+
+        # if the setter fails, we don't know the state of the device
+        self._last_values.pop(name, None)
+        result = self._round_trip(name, method, (value,), {})
+        self._last_values[name] = value
+
+        read = SETTERS[name]
+        if read is not None:
+            self._cache[read] = (self.backend.time(), value)
+
+        return result
+
+    def report(self):
+        """
+        Returns a summary of round trips and saved calls per method.
+        """
+        lines = [str(counter) for counter in self.latency.values()]
+        lines += [
+            '%s: %d calls saved' % (name, count)
+            for name, count in self.saved.items()
+        ]
+        return '\n'.join(lines)
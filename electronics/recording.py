@@ -0,0 +1,245 @@
+import pickle
+import numpy as np
+from time import sleep
+from collections import deque
+from ben.frequency_control.wrapper import ElectronicsWrapper
+
+FORMAT_VERSION = 1
+# arguments that are objects of the caller and are not recorded
+NOT_RECORDED_ARGUMENTS = {'estimator'}
+# calls that are not recorded
+NOT_RECORDED = {'time', 'cleanup'}
+# sub-devices of the backends whose calls are recorded as `device.method`
+RECORDED_DEVICES = {'vhbg', 'miob'}
+
+
+class ReplayMismatch(Exception):
+    pass
+
+
+class ReplayExhausted(Exception):
+    pass
+
+
+class RecordingElectronics(ElectronicsWrapper):
+    """
+    Wraps an electronics backend and records every call with its arguments,
+    its return value (or exception) and its timing to a file that can be
+    replayed by `ReplayElectronics`. Calls of the sub-devices in
+    `RECORDED_DEVICES` (e.g. `electronics.miob.get_temperature()`) are
+    recorded, too.
+
+    Usage:
+
+        fctl = FrequencyControl(
+            lambda: RecordingElectronics(TBusElectronics(), 'run.rec'),
+            ...
+        )
+    """
+    NOT_WRAPPED = NOT_RECORDED
+
+    def __init__(self, backend, filename):
+        super().__init__(backend)
+        self.f = open(filename, 'wb')
+        self._dump({
+            'version': FORMAT_VERSION,
+            'backend': type(backend).__name__,
+            'start': backend.time(),
+        })
+
+    def _dump(self, item):
+        pickle.dump(item, self.f, protocol=pickle.HIGHEST_PROTOCOL)
+        # the file should be usable after a crash
+        self.f.flush()
+
+    def __getattr__(self, name):
+        if name in RECORDED_DEVICES:
+            return RecordingDevice(self, name, getattr(self.backend, name))
+        return super().__getattr__(name)
+
+    def _call(self, name, method, args, kwargs):
+        start = self.backend.time()
+        result, error = None, None
+
+        try:
+            result = method(*args, **kwargs)
+        except Exception as e:
+            error = e
+        duration = self.backend.time() - start
+
+        recorded_kwargs = {
+            key: value for key, value in kwargs.items()
+            if key not in NOT_RECORDED_ARGUMENTS
+        }
+        self._dump(
+            (name, args, recorded_kwargs, result, error, start, duration)
+        )
+
+        if error is not None:
+            raise error
+        return result
+
+    def cleanup(self):
+        try:
+            return self.backend.cleanup()
+        finally:
+            self.f.close()
+
+
+class RecordingDevice:
+    """
+    Records the calls of a sub-device of a backend wrapped by
+    `RecordingElectronics`.
+    """
+    def __init__(self, recording, name, device):
+        self._recording = recording
+        self._name = name
+        self._device = device
+
+    def __getattr__(self, name):
+        attr = getattr(self._device, name)
+
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return self._recording._call(
+                '%s.%s' % (self._name, name), attr, args, kwargs
+            )
+
+        return call
+
+
+def read_recording(filename):
+    """
+    Returns the header and the list of calls of a recording.
+    """
+    calls = []
+    with open(filename, 'rb') as f:
+        header = pickle.load(f)
+        while True:
+            try:
+                calls.append(pickle.load(f))
+            except EOFError:
+                break
+            except pickle.UnpicklingError:
+                # truncated last record
+                break
+    return header, calls
+
+
+def _same(a, b):
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_same(a[k], b[k]) for k in a)
+    if isinstance(a, (tuple, list)) and isinstance(b, (tuple, list)):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    try:
+        return bool(np.allclose(a, b))
+    except TypeError:
+        return a == b
+
+
+class ReplayElectronics:
+    """
+    Serves the calls of a recording made by `RecordingElectronics` without
+    any hardware.
+
+    Every method has its own queue of recorded calls, i.e. the replayed code
+    may call the methods of different instruments in a different order than
+    the recorded one. With `strict=True`, the arguments have to match the
+    recorded ones, otherwise `ReplayMismatch` is raised.
+
+    The time is simulated: every call advances the clock by its recorded
+    duration. With `realtime=True`, the recorded durations are also waited
+    for.
+
+    If an estimator is passed to `measure_frequencies`, it is fed with the
+    recorded ramp at once.
+
+    Only methods and sub-devices that were used in the recording exist,
+    everything else raises `AttributeError`.
+    """
+    def __init__(self, filename, strict=False, realtime=False):
+        self.header, calls = read_recording(filename)
+        self.strict = strict
+        self.realtime = realtime
+        self.now = self.header['start']
+
+        self._queues = {}
+        for call in calls:
+            self._queues.setdefault(call[0], deque()).append(call)
+        self._devices = {
+            name.split('.')[0] for name in self._queues if '.' in name
+        }
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        if name in self._devices:
+            return ReplayDevice(self, name)
+        return self._method(name)
+
+    def _method(self, name):
+        if name not in self._queues:
+            raise AttributeError('%s was not recorded' % name)
+
+        def call(*args, **kwargs):
+            return self._replay(name, args, kwargs)
+
+        return call
+
+    def _replay(self, name, args, kwargs):
+        queue = self._queues.get(name)
+        if not queue:
+            raise ReplayExhausted(name)
+
+        _, recorded_args, recorded_kwargs, result, error, start, duration = \
+            queue.popleft()
+
+        estimator = kwargs.pop('estimator', None)
+        if self.strict and not (
+            _same(args, recorded_args) and _same(kwargs, recorded_kwargs)
+        ):
+            raise ReplayMismatch('%s%r, recorded %s%r' % (
+                name, args, name, recorded_args
+            ))
+
+        if self.realtime:
+            sleep(duration)
+        self.now += duration
+
+        if error is not None:
+            raise error
+
+        if estimator is not None and result is not None:
+            estimator.add(*result)
+
+        return result
+
+    def remaining(self):
+        """
+        Number of recorded calls per method that were not replayed.
+        """
+        return {name: len(queue) for name, queue in self._queues.items()}
+
+    def time(self):
+        return self.now
+
+    def cleanup(self):
+        pass
+
+
+class ReplayDevice:
+    """
+    A sub-device of `ReplayElectronics`.
+    """
+    def __init__(self, replay, name):
+        self._replay = replay
+        self._name = name
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        return self._replay._method('%s.%s' % (self._name, name))
@@ -0,0 +1,313 @@
+import numpy as np
+from time import time
+from ben.frequency_control.config import TARGET_SLOPE, MODE_FREQUENCY_SPACING, \
+    MODE_TEMPERATURE_SPACING, MAX_MEASURABLE_FREQUENCY, RAMP_FREQUENCY
+from ben.frequency_control.utils import wait_for_stable_temperature, \
+    wait_for_stable_frequency
+
+RAMP_CURRENT_SPAN = 15 # mA
+RAMP_POINTS = 128
+# number of samples that are read at once when streaming a ramp
+STREAM_BLOCK_SIZE = 16
+
+# operating point at which mode 0 is centered on the VHBG reflection
+REFERENCE_CURRENT = 110 # mA
+REFERENCE_TEMPERATURE = 25
+REFERENCE_FREQUENCY = 1e9 # Hz
+# how fast the VHBG reflection moves with temperature
+GRATING_TUNING = -MODE_FREQUENCY_SPACING / MODE_TEMPERATURE_SPACING # Hz / K
+# additional detuning that is tolerated before a mode hop occurs
+HOP_HYSTERESIS = 0.1 * MODE_FREQUENCY_SPACING # Hz
+
+# the counter does not see beat notes below this frequency
+MIN_COUNTABLE_FREQUENCY = 100e6 # Hz
+COUNTER_NOISE = 5e6 # Hz
+OUTLIER_PROBABILITY = 0.01
+
+# maximum slew rate and time constant of the VHBG temperature controller
+VHBG_RAMP_RATE = 0.8 # K / s
+VHBG_TIME_CONSTANT = 2 # s
+VHBG_TEMPERATURE_NOISE = 1e-4 # K
+# random walk of the laser frequency
+FREQUENCY_DRIFT = 5e6 # Hz / sqrt(s)
+# after a current step, the chip temperature (and thus the frequency) needs
+# some time to settle. The transient is a fraction of the static tuning.
+CURRENT_TRANSIENT_FRACTION = 0.1
+CURRENT_TIME_CONSTANT = 0.05 # s
+
+# every bus access costs some time on the virtual clock
+BUS_LATENCY = 1e-3 # s
+
+
+class VirtualClock:
+    """
+    A clock that only advances when somebody sleeps on it.
+    """
+    def __init__(self, start=None):
+        self.now = time() if start is None else start
+
+    def time(self):
+        return self.now
+
+    def sleep(self, duration):
+        self.now += max(duration, 0)
+
+
+class SimulatedTEC:
+    """
+    Mimics the interface of a Meerstetter TEC controller.
+
+    The temperature approaches the target temperature with a limited slew
+    rate and a final exponential approach.
+    """
+    def __init__(self, clock, rng, temperature, ramp_rate=VHBG_RAMP_RATE,
+                 time_constant=VHBG_TIME_CONSTANT):
+        self.clock = clock
+        self.rng = rng
+        self.ramp_rate = ramp_rate
+        self.time_constant = time_constant
+        self._temperature = temperature
+        self._target_temperature = temperature
+        self._last_update = clock.time()
+
+    def _update(self):
+        now = self.clock.time()
+        dt = now - self._last_update
+        self._last_update = now
+
+        diff = self._target_temperature - self._temperature
+        # far away from the target, the temperature is ramped with constant
+        # speed. Close to it, it approaches exponentially.
+        linear_range = self.ramp_rate * self.time_constant
+        if np.abs(diff) > linear_range:
+            linear_time = (np.abs(diff) - linear_range) / self.ramp_rate
+            step = np.sign(diff) * self.ramp_rate * min(dt, linear_time)
+            self._temperature += step
+            diff -= step
+            dt -= min(dt, linear_time)
+
+        if dt > 0:
+            self._temperature = self._target_temperature - \
+                diff * np.exp(-dt / self.time_constant)
+
+    @property
+    def true_temperature(self):
+        self._update()
+        return self._temperature
+
+    def get_temperature(self):
+        self.clock.sleep(BUS_LATENCY)
+        return self.true_temperature + \
+            self.rng.normal(0, VHBG_TEMPERATURE_NOISE)
+
+    def get_target_temperature(self):
+        self.clock.sleep(BUS_LATENCY)
+        return self._target_temperature
+
+    def set_target_temperature(self, temperature):
+        self.clock.sleep(BUS_LATENCY)
+        self._update()
+        self._target_temperature = temperature
+
+    def get_parameter(self, name):
+        assert name == 'TARGET_OBJECT_TEMPERATURE'
+        return self.get_target_temperature()
+
+
+class SimulatedElectronics:
+    """
+    Simulates an ECDL with VHBG, a current ramp and a frequency counter.
+
+    Within a mode, the beat frequency depends linearly on the MO current
+    (`TARGET_SLOPE`), adjacent modes are `MODE_FREQUENCY_SPACING` apart.
+    The laser stays in its mode until the mode is detuned from the VHBG
+    reflection by more than half a mode spacing plus a hysteresis; the
+    reflection moves with VHBG temperature.
+
+    All `sleep` calls advance a virtual clock, i.e. a rough lock runs as fast
+    as the CPU allows.
+    """
+    def __init__(self, seed=None, start_temperature=REFERENCE_TEMPERATURE,
+                 start_current=REFERENCE_CURRENT, slope=TARGET_SLOPE,
+                 hysteresis=HOP_HYSTERESIS, noise=COUNTER_NOISE):
+        self.rng = np.random.RandomState(seed)
+        self.clock = VirtualClock()
+        self.slope = slope
+        self.hysteresis = hysteresis
+        self.noise = noise
+
+        self.vhbg = SimulatedTEC(self.clock, self.rng, start_temperature)
+        self.miob = SimulatedTEC(self.clock, self.rng, 40)
+
+        self._current = start_current
+        self._mode = 0
+        self._drift = 0
+        self._last_drift_update = self.clock.time()
+        self._locked_to = None
+        self._ramp_started = False
+        self._transient = 0
+        self._transient_start = self.clock.time()
+
+        self._mode = self._mode_at(start_current, self._mode)
+
+    def time(self):
+        return self.clock.time()
+
+    def sleep(self, duration):
+        self.clock.sleep(duration)
+
+    def _update_drift(self):
+        now = self.clock.time()
+        dt = now - self._last_drift_update
+        self._last_drift_update = now
+        if dt > 0:
+            self._drift += self.rng.normal(0, FREQUENCY_DRIFT * np.sqrt(dt))
+
+    def _current_transient(self):
+        dt = self.clock.time() - self._transient_start
+        return self._transient * np.exp(-dt / CURRENT_TIME_CONSTANT)
+
+    def _mode_frequency(self, current, mode):
+        return self.slope * (current - REFERENCE_CURRENT) + \
+            REFERENCE_FREQUENCY - mode * MODE_FREQUENCY_SPACING + \
+            self._drift + self._current_transient()
+
+    def _grating_frequency(self):
+        return REFERENCE_FREQUENCY + GRATING_TUNING * \
+            (self.vhbg.true_temperature - REFERENCE_TEMPERATURE)
+
+    def _mode_at(self, current, mode, grating=None):
+        """
+        Returns the mode the laser is in after tuning the current to
+        `current`, starting in `mode`.
+        """
+        if grating is None:
+            grating = self._grating_frequency()
+
+        detuning = self._mode_frequency(current, mode) - grating
+        if np.abs(detuning) > MODE_FREQUENCY_SPACING / 2 + self.hysteresis:
+            # hop to the mode closest to the VHBG reflection
+            mode += int(round(detuning / MODE_FREQUENCY_SPACING))
+        return mode
+
+    def _count(self, frequencies):
+        """
+        Simulates the frequency counter: it sees the absolute value of the
+        beat note with some noise, occasional outliers and garbage outside
+        its measurement range.
+        """
+        frequencies = np.abs(frequencies) + \
+            self.rng.normal(0, self.noise, len(frequencies))
+        garbage = (frequencies < MIN_COUNTABLE_FREQUENCY) | \
+            (frequencies > MAX_MEASURABLE_FREQUENCY) | \
+            (self.rng.uniform(size=len(frequencies)) < OUTLIER_PROBABILITY)
+        frequencies[garbage] = self.rng.uniform(
+            0, MAX_MEASURABLE_FREQUENCY, np.sum(garbage)
+        )
+        return frequencies
+
+    def get_vhbg_temperature(self):
+        return self.vhbg.get_temperature()
+
+    def get_vhbg_target_temperature(self):
+        return self.vhbg.get_target_temperature()
+
+    def set_vhbg_target_temperature(self, temperature):
+        self.vhbg.set_target_temperature(temperature)
+
+    def wait_for_stable_temperatures(self):
+        wait_for_stable_temperature(
+            self.vhbg, 0.005, sleep=self.sleep, now=self.time
+        )
+        wait_for_stable_temperature(
+            self.miob, 0.001, sleep=self.sleep, now=self.time
+        )
+
+    def wait_for_stable_frequency(self, max_duration):
+        def read():
+            self._update_drift()
+            currents = self._current + np.linspace(
+                -RAMP_CURRENT_SPAN/2, RAMP_CURRENT_SPAN/2, 8
+            )
+            return self._count(self._mode_frequency(currents, self._mode))
+
+        return wait_for_stable_frequency(
+            read, self.sleep, self.time, max_duration, 1 / RAMP_FREQUENCY
+        )
+
+    def set_laser_current(self, value):
+        self.clock.sleep(BUS_LATENCY)
+        self._update_drift()
+        self._transient = self._current_transient() + \
+            CURRENT_TRANSIENT_FRACTION * self.slope * (value - self._current)
+        self._transient_start = self.clock.time()
+        self._mode = self._mode_at(value, self._mode)
+        self._current = value
+
+    def prepare_ramp_measurement(self):
+        self._ramp_started = True
+
+    def stop_ramp(self):
+        self._ramp_started = False
+
+    def ramp_current_range(self, center_current):
+        return center_current - RAMP_CURRENT_SPAN/2, \
+            center_current + RAMP_CURRENT_SPAN/2
+
+    def measure_frequencies(self, center_current, estimator=None):
+        """
+        Records a ramp. If an `estimator` is given, the samples are fed to it
+        in blocks as they arrive and the acquisition stops as soon as the
+        estimator is done.
+        """
+        self._update_drift()
+        currents = center_current + np.linspace(
+            -RAMP_CURRENT_SPAN/2, RAMP_CURRENT_SPAN/2, RAMP_POINTS
+        )
+
+        if self._locked_to is not None:
+            frequencies = self._count(np.ones(RAMP_POINTS) * self._locked_to)
+            self.clock.sleep(1 / RAMP_FREQUENCY)
+            return currents, frequencies
+
+        if not self._ramp_started:
+            # without a ramp, the current stays constant
+            currents[:] = self._current
+
+        # go to the start of the ramp, sweep it and return to the center.
+        # Mode hops happen along the way.
+        grating = self._grating_frequency()
+        mode = self._mode_at(currents[0], self._mode, grating)
+        modes = np.zeros(RAMP_POINTS, dtype=int)
+        for idx, current in enumerate(currents):
+            mode = self._mode_at(current, mode, grating)
+            modes[idx] = mode
+        self._mode = self._mode_at(self._current, mode, grating)
+
+        frequencies = self._count(self._mode_frequency(currents, modes))
+
+        if estimator is None:
+            self.clock.sleep(1 / RAMP_FREQUENCY + 2 * BUS_LATENCY)
+            return currents, frequencies
+
+        n_read = 0
+        while n_read < RAMP_POINTS:
+            block = slice(n_read, n_read + STREAM_BLOCK_SIZE)
+            estimator.add(currents[block], frequencies[block])
+            n_read = min(n_read + STREAM_BLOCK_SIZE, RAMP_POINTS)
+            self.clock.sleep(
+                STREAM_BLOCK_SIZE / RAMP_POINTS / RAMP_FREQUENCY + BUS_LATENCY
+            )
+            if estimator.done:
+                break
+
+        return currents[:n_read], frequencies[:n_read]
+
+    def cleanup(self):
+        self._locked_to = None
+
+    def lock(self, setpoint):
+        self._locked_to = setpoint
+
+    def unlock(self):
+        self._locked_to = None
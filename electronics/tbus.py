@@ -1,23 +1,52 @@
 import numpy as np
+from time import time, sleep
 from ben.control.client import DeviceClient
-from ben.frequency_control.utils import wait_for_stable_temperature
+from ben.frequency_control.utils import wait_for_stable_temperature, \
+    wait_for_stable_frequency, print_remaining_time
+from ben.frequency_control.metrics import LatencyCounter
 
 RAMP_CURRENT_SPAN = 15 # mA
 PRESCALER = 10
+RAMP_FREQUENCY = 10 # Hz
+# ramper memory addresses of the recorded ramp
+ADDRESS_STEP = 4
+ADDRESSES = [i + 512 for i in range(512)][::ADDRESS_STEP]
+# ramper servers that provide `read_frequency_buffer` return a range of
+# addresses as a packed buffer of counts. The deployed server doesn't, and
+# the device client can't tell, i.e. this has to be enabled explicitly.
+BULK_READOUT = False
+BUFFER_DTYPE = '<u4'
+# a few points of the ramp that are read when waiting for a settled laser
+SETTLE_ADDRESSES = ADDRESSES[::16]
 
 class TBusElectronics:
-    def __init__(self):
-        self.server = DeviceClient('control')
-        self.server.pause_background_services()
-        self.ramper = DeviceClient('ramper')
+    def __init__(self, pause_background_services=True, server='control',
+                 ramper='ramper', ecdl='ecdl', vhbg='vhbg', miob='miob',
+                 ramp_channel=2, counter_channel=0):
+        """
+        The background services of the control server disturb the
+        measurement and are paused for the whole run. If several lasers
+        share the server, pass `pause_background_services=False` and let the
+        orchestrator pause them only during measurements.
+
+        The other arguments are the names of the devices at the control
+        server and the ramper channels of this laser.
+        """
+        self.server = DeviceClient(server)
+        self._pause_background_services = pause_background_services
+        if pause_background_services:
+            self.server.pause_background_services()
+        self.ramper = DeviceClient(ramper)
         self.freq_ctl = self.ramper.card
-        self.ecdl = DeviceClient('ecdl')
-        self.ramp_channel = 2
-        self.counter_channel = 0
-        self.vhbg = DeviceClient('vhbg')
-        self.miob = DeviceClient('miob')
+        self.ecdl = DeviceClient(ecdl)
+        self.ramp_channel = ramp_channel
+        self.counter_channel = counter_channel
+        self.vhbg = DeviceClient(vhbg)
+        self.miob = DeviceClient(miob)
 
         self._ramp_started = False
+        self.bulk_readout = BULK_READOUT
+        self.read_latency = LatencyCounter('ramp readout')
 
         self._coarse_temp_ramp = self.vhbg.get_parameter('COARSE_TEMP_RAMP')
         self._proximity_width = self.vhbg.get_parameter('PROXIMITY_WIDTH')
@@ -32,8 +61,13 @@ class TBusElectronics:
         self.freq_ctl.set_beat_divider(self.counter_channel, 8)
         self.freq_ctl.apply_registers()
 
+    def time(self):
+        return time()
+
+    def sleep(self, duration):
+        sleep(duration)
+
     def get_vhbg_temperature(self):
-        print('messung vhbg')
         return self.vhbg.get_temperature()
 
     def get_vhbg_target_temperature(self):
@@ -44,9 +78,30 @@ class TBusElectronics:
 
     def wait_for_stable_temperatures(self):
         print('warte auf stabile VHBG-Temperatur')
-        wait_for_stable_temperature(self.vhbg, 0.005)
+        wait_for_stable_temperature(
+            self.vhbg, 0.005, sleep=self.sleep, now=self.time,
+            report=print_remaining_time
+        )
         print('warte auf stabile MIOB-Temperatur')
-        wait_for_stable_temperature(self.miob, 0.001)
+        wait_for_stable_temperature(
+            self.miob, 0.001, sleep=self.sleep, now=self.time,
+            report=print_remaining_time
+        )
+
+    def wait_for_stable_frequency(self, max_duration):
+        """
+        Waits until the beat frequency doesn't change anymore, but at most
+        `max_duration` seconds.
+        """
+        def read():
+            return np.array(self.ramper.measure_frequencies(
+                self.counter_channel, addresses=SETTLE_ADDRESSES
+            )) * PRESCALER
+
+        # the ramper memory is refreshed once per ramp
+        return wait_for_stable_frequency(
+            read, self.sleep, self.time, max_duration, 1 / RAMP_FREQUENCY
+        )
 
     def set_laser_current(self, value):
         self.ecdl.set_mo_current(value)
@@ -54,51 +109,82 @@ class TBusElectronics:
     def prepare_ramp_measurement(self):
         # TODO: only if necessary
         if not self._ramp_started:
-            self.ramper.start_ramp(self.ramp_channel, 1, 10)
+            self.ramper.start_ramp(self.ramp_channel, 1, RAMP_FREQUENCY)
             self._ramp_started = True
 
     def stop_ramp(self):
         self.ramper.stop_ramp(self.ramp_channel)
         self._ramp_started = False
 
-    def measure_frequencies(self, center_current):
-        from time import time
-        t1 = time()
-        addresses = list([i+512 for i in range(512)][::4])
-        frequencies = self.ramper.measure_frequencies(
-            self.counter_channel,
-            addresses=addresses
-        )
-        frequencies = list(reversed(list(frequencies)))
-        frequencies = [f * PRESCALER for f in frequencies]
+    def ramp_current_range(self, center_current):
+        return center_current - RAMP_CURRENT_SPAN/2, \
+            center_current + RAMP_CURRENT_SPAN/2
+
+    def _read_ramp(self):
+        """
+        Reads the beat frequencies of the last ramp from the ramper memory.
+
+        The memory holds the ramp in reversed order. With `bulk_readout`,
+        the addresses are read in one call as a packed buffer that is
+        wrapped by a NumPy array without copying. Reversal and prescaler
+        are applied vectorized.
+        """
+        with self.read_latency.timed():
+            if self.bulk_readout:
+                buffer = self.ramper.read_frequency_buffer(
+                    self.counter_channel, ADDRESSES[0], len(ADDRESSES),
+                    ADDRESS_STEP
+                )
+                raw = np.frombuffer(
+                    buffer, dtype=BUFFER_DTYPE, count=len(ADDRESSES)
+                )
+            else:
+                raw = np.array(self.ramper.measure_frequencies(
+                    self.counter_channel, addresses=ADDRESSES
+                ))
 
         # we have a prescaler with factor 10 in beat detection
-        #frequencies = [f*10 for f in frequencies]
+        return raw[::-1] * float(PRESCALER)
+
+    def measure_frequencies(self, center_current, estimator=None):
+        """
+        Reads the beat frequencies of the last ramp from the ramper memory.
+
+        The memory is read at once, every additional request would cost a
+        round trip and could already see the next ramp. An `estimator` is
+        fed with the complete ramp.
+        """
         currents = center_current + \
-            np.linspace(-RAMP_CURRENT_SPAN/2, RAMP_CURRENT_SPAN/2, len(addresses))
+            np.linspace(-RAMP_CURRENT_SPAN/2, RAMP_CURRENT_SPAN/2, len(ADDRESSES))
+        frequencies = self._read_ramp()
 
-        print('counter read time', time() - t1)
-        """from matplotlib import pyplot as plt
-        plt.plot(currents, frequencies)
-        plt.show()"""
+        if estimator is not None:
+            estimator.add(currents, frequencies)
 
         return currents, frequencies
 
     def cleanup(self):
         self.vhbg.set_parameter('COARSE_TEMP_RAMP', self._coarse_temp_ramp)
         self.vhbg.set_parameter('PROXIMITY_WIDTH', self._proximity_width)
-        self.server.continue_background_services()
+        if self._pause_background_services:
+            self.server.continue_background_services()
 
     def lock(self, setpoint):
+        """
+        Lock the beat at the counter channel to `setpoint` by feeding the
+        PID of that channel back to the ramp channel.
+        """
         setpoint /= PRESCALER
         self.freq_ctl.set_and_apply_pid_setpoints(
-            0,
+            self.counter_channel,
             [setpoint, setpoint, setpoint],
             [False, False, False],
         )
-        self.freq_ctl.set_and_apply_pid_factors(3, -1, -1)
-        self.freq_ctl.set_pid_signal_source(3, 0)
-        self.freq_ctl.set_pid_address(0)
+        self.freq_ctl.set_and_apply_pid_factors(self.ramp_channel, -1, -1)
+        self.freq_ctl.set_pid_signal_source(
+            self.ramp_channel, self.counter_channel
+        )
+        self.freq_ctl.set_pid_address(self.counter_channel)
         self.freq_ctl.set_channel_mode_fast(
             self.ramp_channel, int(self.freq_ctl.OUTPUT_MODES.offset_pid)
         )
@@ -109,6 +195,6 @@ class TBusElectronics:
         Turn off the lock.
         """
         self.freq_ctl.set_channel_mode_fast(
-            3, int(self.freq_ctl.OUTPUT_MODES.offset)
+            self.ramp_channel, int(self.freq_ctl.OUTPUT_MODES.offset)
         )
         self.freq_ctl.apply_registers()
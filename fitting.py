@@ -0,0 +1,381 @@
+import numpy as np
+from collections import namedtuple
+
+# steps that deviate from the typical step by more than this many standard
+# deviations are mode hops
+HOP_SIGMAS = 10
+# points deviating from a robust fit by more than this many standard
+# deviations are ignored
+INLIER_SIGMAS = 4
+
+
+def fit_lines(x, y, mask=None):
+    """
+    Least-squares fit of `y = m * x + t` along the last axis.
+
+    `x` and `y` may have any shape `[..., n_points]`, e.g. a stack of
+    ramps. Points where `mask` is False are ignored.
+
+    Returns slope, offset and their standard errors (estimated from the
+    residuals, like `scipy.optimize.curve_fit` does), each with shape `[...]`.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    x, y = np.broadcast_arrays(x, y)
+    w = np.ones(x.shape) if mask is None else np.asarray(mask, dtype=float)
+
+    n = np.sum(w, axis=-1)
+    sx = np.sum(w * x, axis=-1)
+    sy = np.sum(w * y, axis=-1)
+
+    # subtract the mean before building second moments, this avoids loss of
+    # precision for frequencies in the GHz range
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x = sx / n
+        mean_y = sy / n
+    dx = (x - mean_x[..., None]) * w
+    dy = (y - mean_y[..., None]) * w
+
+    sxx = np.sum(dx * dx, axis=-1)
+    sxy = np.sum(dx * dy, axis=-1)
+    syy = np.sum(dy * dy, axis=-1)
+
+    return _solve(n, mean_x, mean_y, sxx, sxy, syy)
+
+
+def _solve(n, mean_x, mean_y, sxx, sxy, syy):
+    """
+    Calculates slope, offset and their standard errors from centered sums.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        m = sxy / sxx
+        t = mean_y - m * mean_x
+
+        residual_variance = np.maximum(syy - m * sxy, 0) / (n - 2)
+        m_err = np.sqrt(residual_variance / sxx)
+        t_err = np.sqrt(residual_variance * (1 / n + mean_x ** 2 / sxx))
+
+    return m, t, m_err, t_err
+
+
+def relative_error(m, t, m_err, t_err):
+    """
+    The quality measure used for accepting a fit: mean relative error of
+    slope and offset.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.mean([np.abs(m_err / m), np.abs(t_err / t)], axis=0)
+
+
+def fit_windows(x, y, min_length=5, lengths=None):
+    """
+    Fits a line to every contiguous window `x[start:stop]` using prefix sums.
+
+    If `lengths` is None, all windows with at least `min_length` points are
+    fitted (O(n²) windows, fully vectorized). Otherwise, only windows with
+    the given lengths are considered (O(n) windows per length).
+
+    Returns `starts, stops, m, t, m_err, t_err` as flat arrays.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n_points = len(x)
+
+    # centering keeps the prefix sums of squares small
+    x0, y0 = np.mean(x), np.mean(y)
+    x = x - x0
+    y = y - y0
+
+    def prefix_sum(a):
+        return np.concatenate([[0], np.cumsum(a)])
+
+    cx, cy = prefix_sum(x), prefix_sum(y)
+    cxx, cxy, cyy = prefix_sum(x * x), prefix_sum(x * y), prefix_sum(y * y)
+
+    if lengths is None:
+        starts, stops = np.triu_indices(n_points + 1, k=max(min_length, 1))
+    else:
+        lengths = [l for l in lengths if 0 < l <= n_points]
+        starts = np.concatenate(
+            [np.arange(n_points - l + 1) for l in lengths] or [[]]
+        ).astype(int)
+        stops = starts + np.repeat(
+            lengths, [n_points - l + 1 for l in lengths]
+        ).astype(int)
+
+    n = stops - starts
+    sx = cx[stops] - cx[starts]
+    sy = cy[stops] - cy[starts]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x = sx / n
+        mean_y = sy / n
+    sxx = cxx[stops] - cxx[starts] - sx * mean_x
+    sxy = cxy[stops] - cxy[starts] - sx * mean_y
+    syy = cyy[stops] - cyy[starts] - sy * mean_y
+
+    m, t, m_err, t_err = _solve(n, mean_x + x0, mean_y + y0, sxx, sxy, syy)
+
+    return starts, stops, m, t, m_err, t_err
+
+
+def find_mode_window(x, y, is_good_slope, max_err, min_length=5,
+                     lengths=None):
+    """
+    Searches the longest contiguous window of `(x, y)` that looks like a
+    laser mode, i.e. whose (possibly mirrored) slope passes `is_good_slope`
+    and whose relative fit error is below `max_err`.
+
+    Returns `start, stop, mirror, slope, shift, err` or None.
+    """
+    if len(x) < min_length:
+        return
+
+    starts, stops, m, t, m_err, t_err = fit_windows(
+        x, y, min_length=min_length, lengths=lengths
+    )
+    errs = relative_error(m, t, m_err, t_err)
+
+    # the counter only sees absolute frequencies, a positive slope is a
+    # mirrored mode
+    mirror = m > 0
+    slopes = np.where(mirror, -m, m)
+    shifts = np.where(mirror, -t, t)
+
+    good = np.flatnonzero(is_good_slope(slopes) & (errs < max_err))
+    if not len(good):
+        return
+
+    # longest window first, smallest error for equally long windows
+    best = good[np.lexsort((errs[good], starts[good] - stops[good]))[0]]
+
+    return int(starts[best]), int(stops[best]), bool(mirror[best]), \
+        slopes[best], shifts[best], errs[best]
+
+
+Segment = namedtuple(
+    'Segment', ['start', 'stop', 'mirror', 'slope', 'shift', 'err', 'inliers']
+)
+
+
+def theil_sen(x, y):
+    """
+    Robust line fit: the slope is the median of all pairwise slopes.
+    """
+    i, j = np.triu_indices(len(x), 1)
+    dx = x[j] - x[i]
+    valid = dx != 0
+    m = np.median((y[j] - y[i])[valid] / dx[valid])
+    t = np.median(y - m * x)
+    return m, t
+
+
+def _robust_sigma(values, scale):
+    """
+    Standard deviation estimated from the median absolute deviation.
+    For noise-free data, a tiny fraction of `scale` is returned.
+    """
+    sigma = 1.4826 * np.median(np.abs(values - np.median(values)))
+    return max(sigma, 1e-9 * scale)
+
+
+def find_hops(x, y, threshold=None):
+    """
+    Detects mode hops in a ramp, i.e. steps between consecutive points that
+    are much larger than expected for the distance of their currents `x`.
+    Only the size of the steps is compared: if the beat note folds through
+    zero or the current sweep turns around, the sign of the steps changes,
+    but this is not a hop. A single outlier causes two large steps in
+    opposite directions and is reported separately.
+
+    Returns the indices `k` of hops between points `k - 1` and `k` and the
+    indices of outliers.
+    """
+    steps = np.diff(y)
+    sizes = np.abs(steps)
+    distances = np.abs(np.diff(x))
+    moving = distances > 0
+    if np.any(moving):
+        rate = np.median(sizes[moving] / distances[moving])
+        expected = rate * distances
+        expected_pair = rate * np.abs(x[2:] - x[:-2])
+    else:
+        expected = np.full(len(sizes), np.median(sizes))
+        expected_pair = expected[1:]
+
+    deviation = sizes - expected
+    if threshold is None:
+        threshold = HOP_SIGMAS * _robust_sigma(deviation, np.max(np.abs(y)))
+
+    big = deviation > threshold
+    # an outlier at k + 1: steps k and k + 1 are both large and opposite,
+    # but point k + 2 follows point k as expected
+    pair = big[:-1] & big[1:] & \
+        (np.sign(steps[:-1]) != np.sign(steps[1:])) & \
+        (np.abs(steps[:-1] + steps[1:]) - expected_pair < threshold)
+    outliers = np.flatnonzero(pair) + 1
+
+    big[outliers - 1] = False
+    big[outliers] = False
+
+    return np.flatnonzero(big) + 1, outliers
+
+
+def find_fold(x, y):
+    """
+    Returns the index at which a ramp of the (unsigned) beat note folds
+    through zero, i.e. the slope changes its sign at the minimum. Returns
+    None if the ramp doesn't fold.
+    """
+    k = int(np.argmin(np.abs(y)))
+    if k < 2 or k > len(y) - 2:
+        return
+
+    left = fit_lines(x[:k], y[:k])[0]
+    right = fit_lines(x[k:], y[k:])[0]
+    if np.sign(left) != np.sign(right):
+        return k
+
+
+def segment_ramp(x, y, min_length=5, threshold=None):
+    """
+    Splits a ramp at mode hops into linear segments and fits every segment
+    robustly: a Theil-Sen fit identifies inliers, which are then fitted with
+    least squares.
+
+    Returns the segments with at least `min_length` inliers and the currents
+    of the mode hops at their edges. A part of a mode where the beat note folds
+    through zero is split into two segments, but the fold is no mode hop.
+    Like in `find_mode_window`, segments with a positive slope are mirrored.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if len(x) < max(min_length, 3):
+        return [], []
+
+    hops, outliers = find_hops(x, y, threshold)
+    is_outlier = np.zeros(len(x), dtype=bool)
+    is_outlier[outliers] = True
+
+    pieces = []
+    boundaries = np.concatenate([[0], hops, [len(x)]]).astype(int)
+    for start, stop in zip(boundaries[:-1], boundaries[1:]):
+        fold = None
+        if stop - start >= 2 * min_length:
+            fold = find_fold(x[start:stop], y[start:stop])
+        if fold is None:
+            pieces.append((start, stop))
+        else:
+            pieces += [(start, start + fold), (start + fold, stop)]
+
+    segments = []
+    for start, stop in pieces:
+        idxs = np.arange(start, stop)[~is_outlier[start:stop]]
+        if len(idxs) < min_length:
+            continue
+
+        m, t = theil_sen(x[idxs], y[idxs])
+        residuals = y[idxs] - (m * x[idxs] + t)
+        sigma = _robust_sigma(residuals, np.max(np.abs(y[idxs])))
+        idxs = idxs[np.abs(residuals) <= INLIER_SIGMAS * sigma]
+        if len(idxs) < min_length:
+            continue
+
+        m, t, m_err, t_err = fit_lines(x[idxs], y[idxs])
+        err = relative_error(m, t, m_err, t_err)
+        mirror = m > 0
+        if mirror:
+            m, t = -m, -t
+
+        segments.append(Segment(
+            int(start), int(stop), bool(mirror), m, t, err, idxs
+        ))
+
+    # hops within garbage (e.g. out of the counter range) are no boundaries
+    # of a mode
+    edges = {segment.start for segment in segments} | \
+        {segment.stop for segment in segments}
+    hop_currents = [(x[k - 1] + x[k]) / 2 for k in hops if k in edges]
+
+    return segments, hop_currents
+
+
+class IncrementalLineFit:
+    """
+    Least-squares line fit that is updated while the samples of a ramp
+    arrive, either one by one or in blocks.
+
+    Only the number of points, the means and the centered second moments are
+    kept. `done` becomes True as soon as enough points were recorded and the
+    slope is known well enough to tell whether the ramp shows a laser mode:
+    either it is a good mode with an error below `max_err`, or the slope is
+    clearly wrong. The acquisition can then be stopped early.
+    """
+    def __init__(self, is_good_slope, max_err, min_points):
+        self.is_good_slope = is_good_slope
+        self.max_err = max_err
+        self.min_points = min_points
+
+        self.n = 0
+        self.mean_x = 0.
+        self.mean_y = 0.
+        self.sxx = 0.
+        self.sxy = 0.
+        self.syy = 0.
+
+    def add(self, x, y):
+        """
+        Adds one or several samples.
+        """
+        x = np.atleast_1d(np.asarray(x, dtype=float))
+        y = np.atleast_1d(np.asarray(y, dtype=float))
+        n_b = len(x)
+        if not n_b:
+            return
+
+        mean_x_b, mean_y_b = np.mean(x), np.mean(y)
+        dx, dy = x - mean_x_b, y - mean_y_b
+
+        # combine the moments of both sets of samples
+        n = self.n + n_b
+        delta_x = mean_x_b - self.mean_x
+        delta_y = mean_y_b - self.mean_y
+        weight = self.n * n_b / n
+
+        self.sxx += np.sum(dx * dx) + delta_x * delta_x * weight
+        self.sxy += np.sum(dx * dy) + delta_x * delta_y * weight
+        self.syy += np.sum(dy * dy) + delta_y * delta_y * weight
+        self.mean_x += delta_x * n_b / n
+        self.mean_y += delta_y * n_b / n
+        self.n = n
+
+    def fit(self):
+        """
+        Returns slope, offset and their standard errors.
+        """
+        return _solve(
+            self.n, self.mean_x, self.mean_y, self.sxx, self.sxy, self.syy
+        )
+
+    @property
+    def is_good(self):
+        m, t, m_err, t_err = self.fit()
+        return bool(
+            self.is_good_slope(-np.abs(m)) and
+            relative_error(m, t, m_err, t_err) < self.max_err
+        )
+
+    @property
+    def is_bad(self):
+        m, t, m_err, t_err = self.fit()
+        return bool(
+            np.abs(m_err / m) < self.max_err and
+            not self.is_good_slope(-np.abs(m))
+        )
+
+    @property
+    def done(self):
+        if self.n < max(self.min_points, 3):
+            return False
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.is_good or self.is_bad
@@ -0,0 +1,134 @@
+import numpy as np
+from config import CURRENT_LIMITS, MODE_FREQUENCY_SPACING
+from utils import line
+
+# possible excursions of the MO current (in mA) for forcing a mode hop,
+# the last one goes to the current limit
+AMPLITUDES = (5, 10, 20, np.inf)
+# an excursion is used if it reaches the desired mode with this probability
+MIN_SUCCESS_PROBABILITY = 0.8
+# success probability of an excursion to the current limit before anything
+# was observed
+FULL_EXCURSION_PRIOR = 0.9
+# an untried excursion is expected to be a bit less reliable than the next
+# larger one
+PRIOR_DECAY = 0.95
+# weight of the prior in number of observations
+PRIOR_STRENGTH = 2
+# an untried excursion is only probed after the next larger one succeeded
+# this often
+PROBE_AFTER_SUCCESSES = 3
+# excursions are only learned if the desired mode is at most this many
+# modes away. Farther modes can't be reached without changing the VHBG
+# temperature.
+MAX_LEARNED_HOPS = 1
+
+
+class HopStrategy:
+    """
+    Learns which excursion of the MO current reliably brings the laser to a
+    desired mode.
+
+    Before every measurement, the current is moved away from the target
+    current and back in order to force a mode hop. Every excursion is
+    rated by comparing the fits before and after it: was the desired mode
+    reached? Per direction and number of desired hops, the smallest
+    excursion that already succeeded and has a high estimated success
+    probability is chosen. The strategy starts with the full excursion, the
+    next smaller one is probed once the current one succeeded
+    `PROBE_AFTER_SUCCESSES` times.
+    """
+    def __init__(self):
+        # (direction, hops, amplitude index) -> [successes, trials]
+        self.observations = {}
+
+    def desired_hops(self, slope, shift, current, target_frequency):
+        """
+        Number of modes between the fitted mode and the mode that reaches
+        `target_frequency` at `current`. Positive numbers mean lower
+        frequencies, as for `delta_mode`.
+        """
+        return int(np.round(
+            (line(current, slope, shift) - target_frequency) /
+            MODE_FREQUENCY_SPACING
+        ))
+
+    def hops(self, before, after, current):
+        """
+        Number of modes between the fits `before` and `after` (both
+        `(slope, shift)`), compared at `current`.
+        """
+        return int(np.round(
+            (line(current, *before) - line(current, *after)) /
+            MODE_FREQUENCY_SPACING
+        ))
+
+    def success_probabilities(self, direction, hops):
+        """
+        Estimated success probabilities of all `AMPLITUDES`.
+        """
+        probabilities = np.zeros(len(AMPLITUDES))
+        prior = FULL_EXCURSION_PRIOR / PRIOR_DECAY
+
+        for idx in reversed(range(len(AMPLITUDES))):
+            prior *= PRIOR_DECAY
+            successes, trials = self.observations.get(
+                (direction, hops, idx), (0, 0)
+            )
+            probabilities[idx] = (successes + prior * PRIOR_STRENGTH) / \
+                (trials + PRIOR_STRENGTH)
+            prior = probabilities[idx]
+
+        return probabilities
+
+    def choose(self, direction, hops):
+        """
+        Returns the index of the excursion amplitude to use.
+        """
+        if np.abs(hops) > MAX_LEARNED_HOPS:
+            return len(AMPLITUDES) - 1
+
+        probabilities = self.success_probabilities(direction, hops)
+        successes, trials = np.array([
+            self.observations.get((direction, hops, idx), (0, 0))
+            for idx in range(len(AMPLITUDES))
+        ]).T
+
+        # the priors alone never justify a smaller excursion than the full
+        # one, it has to have succeeded before
+        tried = np.flatnonzero(successes > 0)
+        tried = np.union1d(tried, [len(AMPLITUDES) - 1])
+        good = tried[probabilities[tried] >= MIN_SUCCESS_PROBABILITY]
+        if not len(good):
+            # the largest of the best excursions
+            return tried[::-1][np.argmax(probabilities[tried][::-1])]
+
+        best = good[0]
+        smaller = best - 1
+        if smaller >= 0 and not trials[smaller] and \
+                successes[best] >= PROBE_AFTER_SUCCESSES and \
+                probabilities[smaller] >= MIN_SUCCESS_PROBABILITY:
+            return smaller
+        return best
+
+    def excursion_current(self, target_current, direction, amplitude_idx):
+        """
+        The current to go to before returning to `target_current`.
+        """
+        return np.clip(
+            target_current + direction * AMPLITUDES[amplitude_idx],
+            *CURRENT_LIMITS
+        )
+
+    def add(self, direction, hops, amplitude_idx, success):
+        """
+        Adds the result of an excursion.
+        """
+        if np.abs(hops) > MAX_LEARNED_HOPS:
+            return
+
+        counts = self.observations.setdefault(
+            (direction, hops, amplitude_idx), [0, 0]
+        )
+        counts[0] += int(success)
+        counts[1] += 1
@@ -0,0 +1,170 @@
+import json
+import struct
+import numpy as np
+from os import makedirs, path as os_path
+from time import time
+
+MAGIC = b'RLOG1\n'
+
+# record types
+TEXT = 0
+RAMP = 1
+FIT = 2
+META = 3
+
+# type, timestamp, payload length
+RECORD_HEADER = struct.Struct('<BdI')
+# number of points of curr / freq and of curr_interval, slope, shift
+FIT_HEADER = struct.Struct('<IIdd')
+RAMP_HEADER = struct.Struct('<I')
+
+# records are collected in memory and written in chunks of this size
+CHUNK_SIZE = 64 * 1024
+
+
+def _pack_arrays(*arrays):
+    return b''.join(
+        np.asarray(array, dtype='<f4').tobytes() for array in arrays
+    )
+
+
+def _unpack_arrays(payload, offset, *lengths):
+    arrays = []
+    for length in lengths:
+        arrays.append(np.frombuffer(payload, '<f4', length, offset))
+        offset += 4 * length
+    return arrays
+
+
+class LogWriter:
+    """
+    Appends log entries of a rough lock to a binary file.
+
+    Strings are stored as text records, `(curr, freq)` as ramp records and
+    `(curr, freq, curr_interval, slope, shift)` as fit records. Arrays are
+    stored as float32. Records are buffered and written in chunks, i.e.
+    memory usage doesn't grow during long runs.
+    """
+    def __init__(self, filename, clock=time):
+        directory = os_path.dirname(filename)
+        if directory:
+            makedirs(directory, exist_ok=True)
+
+        self.filename = filename
+        self.clock = clock
+        self.f = open(filename, 'wb')
+        self.f.write(MAGIC)
+        self._buffer = bytearray()
+
+    def _append(self, type_, payload):
+        self._buffer += RECORD_HEADER.pack(type_, self.clock(), len(payload))
+        self._buffer += payload
+
+        if len(self._buffer) >= CHUNK_SIZE:
+            self.flush()
+
+    def write(self, item):
+        if isinstance(item, str):
+            self._append(TEXT, item.encode('utf-8'))
+        elif len(item) == 2:
+            curr, freq = item
+            self._append(
+                RAMP, RAMP_HEADER.pack(len(curr)) + _pack_arrays(curr, freq)
+            )
+        else:
+            curr, freq, curr_interval, slope, shift = item
+            self._append(
+                FIT,
+                FIT_HEADER.pack(len(curr), len(curr_interval), slope, shift) +
+                _pack_arrays(curr, freq, curr_interval)
+            )
+
+    def write_meta(self, meta):
+        self._append(META, json.dumps(meta).encode('utf-8'))
+
+    def flush(self):
+        if self.f.closed:
+            return
+
+        self.f.write(self._buffer)
+        self.f.flush()
+        self._buffer = bytearray()
+
+    def close(self):
+        if not self.f.closed:
+            self.flush()
+            self.f.close()
+
+
+class LogReader:
+    """
+    Lazily reads a log file written by `LogWriter`.
+
+    Iterating yields the log entries in the format of `RoughLock.log`, i.e.
+    it can be passed to `plotting.replay`. Meta records are skipped,
+    use `meta()` for them. A truncated last record (e.g. after a crash) is
+    ignored.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+
+    def records(self):
+        """
+        Yields `(type, timestamp, item)` for every record.
+        """
+        with open(self.filename, 'rb') as f:
+            assert f.read(len(MAGIC)) == MAGIC, 'not a rough lock log'
+
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                type_, timestamp, length = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    return
+
+                yield type_, timestamp, self._decode(type_, payload)
+
+    def _decode(self, type_, payload):
+        if type_ == TEXT:
+            return payload.decode('utf-8')
+        elif type_ == META:
+            return json.loads(payload.decode('utf-8'))
+        elif type_ == RAMP:
+            n, = RAMP_HEADER.unpack_from(payload)
+            return tuple(_unpack_arrays(payload, RAMP_HEADER.size, n, n))
+        elif type_ == FIT:
+            n, m, slope, shift = FIT_HEADER.unpack_from(payload)
+            curr, freq, curr_interval = _unpack_arrays(
+                payload, FIT_HEADER.size, n, n, m
+            )
+            return curr, freq, curr_interval, slope, shift
+
+        raise ValueError('unknown record type %d' % type_)
+
+    def __iter__(self):
+        for type_, timestamp, item in self.records():
+            if type_ != META:
+                yield item
+
+    def meta(self):
+        """
+        Returns all meta records merged into one dictionary.
+        """
+        meta = {}
+        for type_, timestamp, item in self.records():
+            if type_ == META:
+                meta.update(item)
+        return meta
+
+
+def read_log(filename):
+    """
+    Returns the log entries of a binary log or of an old JSON log.
+    """
+    if filename.endswith('.json'):
+        with open(filename, 'r') as f:
+            return json.load(f)['log']
+
+    return LogReader(filename)
@@ -0,0 +1,73 @@
+import numpy as np
+from time import perf_counter
+from contextlib import contextmanager
+
+# number of recent durations that are kept for percentiles
+HISTORY_LENGTH = 1000
+
+
+class LatencyCounter:
+    """
+    Collects the durations of a repeated operation, e.g. a bus access.
+
+    Usage:
+
+        counter = LatencyCounter('ramp readout')
+        with counter.timed():
+            ...
+        print(counter)
+    """
+    def __init__(self, name, history_length=HISTORY_LENGTH):
+        self.name = name
+        self.history_length = history_length
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+        self.history = []
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+        self.history.append(duration)
+        if len(self.history) > self.history_length:
+            del self.history[:len(self.history) - self.history_length]
+
+    @contextmanager
+    def timed(self):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(perf_counter() - start)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.
+
+    def percentile(self, q):
+        """
+        The `q`-th percentile of the recent durations.
+        """
+        if not self.history:
+            return 0.
+        return float(np.percentile(self.history, q))
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+    def __str__(self):
+        return '%s: %d calls, mean %.2fms, p99 %.2fms, max %.2fms' % (
+            self.name, self.count, self.mean * 1e3, self.percentile(99) * 1e3,
+            self.max * 1e3
+        )
@@ -0,0 +1,89 @@
+import json
+from os import makedirs, replace, path as os_path
+
+# operating points closer than this share a cache entry
+TEMPERATURE_RESOLUTION = 0.05 # K
+CURRENT_RESOLUTION = 1 # mA
+# the laser drifts, older entries are discarded
+MAX_AGE = 30 * 60 # s
+
+
+class ModeCache:
+    """
+    Persistent cache of laser modes that were fitted at an operating point
+    (VHBG temperature, MO current).
+
+    Every entry contains slope and shift of the mode and the currents of
+    observed mode boundaries. Entries older than `max_age` seconds are
+    discarded. Their age is measured with `clock`, `FrequencyControl` sets
+    it to the clock of its electronics if none is given.
+
+    Usage:
+
+        fctl = FrequencyControl(
+            ...,
+            mode_cache=ModeCache(DATA_FOLDER + 'mode_cache.json')
+        )
+    """
+    def __init__(self, filename, max_age=MAX_AGE, clock=None):
+        self.filename = filename
+        self.max_age = max_age
+        self.clock = clock
+        self.entries = {}
+
+        if os_path.exists(filename):
+            with open(filename, 'r') as f:
+                for entry in json.load(f):
+                    self.entries[self._key(
+                        entry['temperature'], entry['current']
+                    )] = entry
+
+    def _key(self, temperature, current):
+        return (
+            int(round(temperature / TEMPERATURE_RESOLUTION)),
+            int(round(current / CURRENT_RESOLUTION))
+        )
+
+    def evict(self):
+        """
+        Removes entries that are older than `max_age`.
+        """
+        now = self.clock()
+        self.entries = {
+            key: entry for key, entry in self.entries.items()
+            if now - entry['timestamp'] < self.max_age
+        }
+
+    def lookup(self, temperature, current):
+        """
+        Returns the fresh entry for the given operating point (or None).
+        """
+        self.evict()
+        return self.entries.get(self._key(temperature, current))
+
+    def update(self, temperature, current, slope, shift, boundaries=()):
+        """
+        Stores a fitted mode and saves the cache.
+        """
+        self.entries[self._key(temperature, current)] = {
+            'temperature': float(temperature),
+            'current': float(current),
+            'slope': float(slope),
+            'shift': float(shift),
+            'boundaries': [float(b) for b in boundaries],
+            'timestamp': self.clock(),
+        }
+        self.evict()
+        self.save()
+
+    def save(self):
+        directory = os_path.dirname(self.filename)
+        if directory:
+            makedirs(directory, exist_ok=True)
+
+        # write to a temporary file first, a crash can't corrupt the cache
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(list(self.entries.values()), f)
+        replace(tmp_filename, self.filename)
+
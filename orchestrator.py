@@ -0,0 +1,200 @@
+"""
+Brings several lasers to their target frequencies at the same time.
+
+Every laser runs its own rough lock in a thread. Instruments that are
+shared by the lasers (e.g. the ramper card and its counter) are only used
+by one laser at a time, in the order of the requests.
+
+Usage:
+
+    server = DeviceClient('control')
+    services = SharedPause(
+        server.pause_background_services,
+        server.continue_background_services
+    )
+    results = run_lasers([
+        Laser('ecdl1', partial(TBusElectronics, pause_background_services=False),
+              [2.4e9, 4.4e9], 110, 25),
+        Laser('ecdl2', partial(TBusElectronics, pause_background_services=False,
+                               ecdl='ecdl2', vhbg='vhbg2', miob='miob2',
+                               ramp_channel=3, counter_channel=1),
+              [1.2e9, 3.2e9], 105, 24),
+    ], services=services)
+"""
+import threading
+from collections import namedtuple
+from contextlib import contextmanager, ExitStack
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from traceback import print_exc
+from sweep import run_cell
+from wrapper import ElectronicsWrapper
+
+# shared instruments that are used by a command. Commands that are not
+# listed only access instruments of their own laser.
+SHARED_INSTRUMENTS = {
+    'wait_for_stable_frequency': ('ramper',),
+    'prepare_ramp_measurement': ('ramper',),
+    'measure_frequencies': ('ramper',),
+    'stop_ramp': ('ramper',),
+    'lock': ('ramper',),
+    'unlock': ('ramper',),
+}
+# commands that must not be disturbed by the background services of the
+# control server
+CRITICAL_SECTIONS = {
+    'wait_for_stable_frequency', 'measure_frequencies', 'lock'
+}
+
+Laser = namedtuple(
+    'Laser',
+    ['name', 'electronics', 'target_frequencies', 'start_current',
+     'start_temperature']
+)
+
+
+class FifoLock:
+    """
+    A lock that is acquired in the order of the requests, i.e. no laser can
+    starve the others.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+
+    def acquire(self):
+        with self._condition:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            while self._serving != ticket:
+                self._condition.wait()
+
+    def release(self):
+        with self._condition:
+            self._serving += 1
+            self._condition.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+        return False
+
+
+class SharedPause:
+    """
+    Pauses something (e.g. the background services of the control server)
+    while at least one laser is in a critical section.
+    """
+    def __init__(self, pause, resume):
+        self._pause = pause
+        self._resume = resume
+        self._lock = threading.Lock()
+        self._count = 0
+
+    def __enter__(self):
+        with self._lock:
+            if self._count == 0:
+                self._pause()
+            self._count += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self._count -= 1
+            if self._count == 0:
+                self._resume()
+        return False
+
+
+class InstrumentScheduler:
+    """
+    Hands out shared instruments to the lasers.
+    """
+    def __init__(self, services=None):
+        self.services = services
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _instrument_lock(self, instrument):
+        with self._lock:
+            if instrument not in self._locks:
+                self._locks[instrument] = FifoLock()
+            return self._locks[instrument]
+
+    @contextmanager
+    def reserve(self, instruments, critical=False):
+        """
+        Context manager that waits until all `instruments` are available.
+        In `critical` sections, the services are paused.
+        """
+        with ExitStack() as stack:
+            # always in the same order, otherwise two lasers could deadlock
+            for instrument in sorted(instruments):
+                stack.enter_context(self._instrument_lock(instrument))
+            if critical and self.services is not None:
+                stack.enter_context(self.services)
+            yield
+
+
+class ScheduledElectronics(ElectronicsWrapper):
+    """
+    Wraps the electronics of one laser such that commands using shared
+    instruments wait for the `InstrumentScheduler`.
+    """
+    def __init__(self, backend, scheduler):
+        super().__init__(backend)
+        self.scheduler = scheduler
+
+    def _call(self, name, method, args, kwargs):
+        instruments = SHARED_INSTRUMENTS.get(name)
+        critical = name in CRITICAL_SECTIONS
+        if instruments is None and not critical:
+            return method(*args, **kwargs)
+
+        with self.scheduler.reserve(instruments or (), critical):
+            return method(*args, **kwargs)
+
+
+def run_lasers(lasers, services=None, max_workers=None):
+    """
+    Performs the rough lock of all `lasers` concurrently.
+
+    `services` is a `SharedPause` that is held while a laser is in a
+    critical section. Returns a dictionary mapping the names of the lasers to
+    the results of `sweep.run_cell` (or the exception that occurred).
+    """
+    scheduler = InstrumentScheduler(services)
+    results = {}
+
+    def scheduled(electronics):
+        def create():
+            # the constructors of the backends configure the ramper card
+            with scheduler.reserve(('ramper',)):
+                backend = electronics()
+            return ScheduledElectronics(backend, scheduler)
+
+        return create
+
+    with ThreadPoolExecutor(max_workers or len(lasers)) as pool:
+        futures = {
+            pool.submit(
+                run_cell, scheduled(laser.electronics),
+                laser.target_frequencies, laser.start_temperature,
+                laser.start_current, miob_samples=0, name=laser.name
+            ): laser.name
+            for laser in lasers
+        }
+
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                print('EXC', name)
+                print_exc()
+                results[name] = e
+
+    return results
@@ -0,0 +1,73 @@
+import numpy as np
+from collections import namedtuple
+from config import DELTA_MODES, MODE_FREQUENCY_SPACING, TARGET_CURRENTS, \
+    MODE_WIDTH, MODE_TEMPERATURE_SPACING
+
+# rough durations used for estimating the time to lock
+TEMPERATURE_TIME = 1.25 # s / K, the VHBG is ramped with ~0.8 K/s
+HOP_TIME = 1 # s, every mode hop needs at least one more iteration
+EDGE_TIME = 1 # s, for target currents directly at the edge of the range
+# target currents closer than this to the edges of the range are penalized
+EDGE_MARGIN = 5 # mA
+
+Plan = namedtuple(
+    'Plan',
+    ['delta_mode', 'target_current', 'temp_direction', 'target_currents',
+     'cost']
+)
+
+
+def plan_target_modes(slope, shift, target_frequencies, start_current,
+                      delta_modes=DELTA_MODES):
+    """
+    Extrapolates the current mode (`slope`, `shift`) to all modes in
+    `delta_modes` and returns the plans that reach all target frequencies
+    with allowed currents, sorted by the expected time to lock.
+
+    The expected time accounts for the VHBG temperature travel (one mode
+    spacing per mode hop and per mode width of current travel), the number
+    of mode hops and the distance of the target currents to the edges of
+    `TARGET_CURRENTS`.
+    """
+    delta_modes = np.asarray(delta_modes)
+    target_frequencies = np.asarray(target_frequencies, dtype=float)
+
+    # currents needed for reaching every target frequency in every mode,
+    # shape (modes, targets)
+    mode_shifts = shift - delta_modes * MODE_FREQUENCY_SPACING
+    currents = (target_frequencies[None, :] - mode_shifts[:, None]) / slope
+
+    margins = np.minimum(
+        currents - TARGET_CURRENTS[0], TARGET_CURRENTS[1] - currents
+    ).min(axis=1)
+    reachable = margins >= 0
+
+    target_current = (currents.min(axis=1) + currents.max(axis=1)) / 2
+    current_travel = np.abs(target_current - start_current)
+
+    temperature_travel = MODE_TEMPERATURE_SPACING * (
+        np.abs(delta_modes) + current_travel / MODE_WIDTH
+    )
+    edge_penalty = np.clip(1 - margins / EDGE_MARGIN, 0, 1)
+    cost = TEMPERATURE_TIME * temperature_travel + \
+        HOP_TIME * np.abs(delta_modes) + EDGE_TIME * edge_penalty
+
+    # staying in the current mode: ramp the VHBG temperature such that the
+    # mode moves in the right direction. Otherwise: ramp it such that it
+    # will eventually allow reaching the other mode.
+    temp_direction = np.where(
+        delta_modes == 0,
+        np.where(target_current - start_current > 0, 1, -1),
+        np.sign(delta_modes)
+    )
+
+    # stable sort, i.e. equal costs keep the order of `delta_modes`
+    order = [idx for idx in np.argsort(cost, kind='stable') if reachable[idx]]
+
+    return [
+        Plan(
+            int(delta_modes[idx]), target_current[idx],
+            int(temp_direction[idx]), currents[idx], cost[idx]
+        )
+        for idx in order
+    ]
@@ -0,0 +1,63 @@
+"""
+Plots of the rough lock for debugging. Only imported if something is plotted,
+matplotlib and seaborn are slow to import.
+"""
+import numpy as np
+import seaborn as sns
+from matplotlib import pyplot as plt
+from config import CURRENT_LIMITS, DELTA_MODES, MODE_FREQUENCY_SPACING
+from utils import line, greater, smaller
+
+
+def replay(target_frequencies, log, to_call=None):
+    for item in log:
+        if isinstance(item, tuple) or isinstance(item, list):
+            if len(item) == 2:
+                plt.plot(item[0], item[1])
+                plt.show(block=True)
+            else:
+                curr, freq, curr_interval, slope, shift = item
+                plot_ramp(
+                    target_frequencies,
+                    curr, freq, curr_interval, lambda x: line(x, slope, shift),
+                    to_call=to_call
+                )
+                plt.show(block=True)
+        else:
+            print(item)
+
+
+def plot_ramp(target_frequencies, curr, freq, curr_interval, fit, to_call=None,
+              show=True):
+    """
+    Plot overview of current mode and extrapolated modes.
+    """
+    linewidth = 3
+    palette = sns.color_palette()
+    x = np.linspace(*CURRENT_LIMITS)
+    for target_frequency in target_frequencies:
+        plt.plot(x, [target_frequency/1e9] * len(x), color='black', linestyle='--', linewidth=linewidth)
+
+    for d in DELTA_MODES:
+        if d == 0:
+            color = palette[1]
+        else:
+            color = palette[0]
+        plt.plot(x, (fit(x) + d * MODE_FREQUENCY_SPACING) / 1e9, linestyle='dotted', color=color, alpha=1, linewidth=linewidth)
+
+    plt.plot(curr_interval, fit(np.array(curr_interval)) / 1e9, color=palette[1], linewidth=linewidth)
+
+    #plt.plot(curr, freq, 'g')
+
+    plt.ylim(
+        smaller(min(freq) / 1e9, min(target_frequencies) / 1e9) - 0,
+        greater(max(freq) / 1e9, max(target_frequencies) / 1e9) + 0,
+    )
+
+    plt.grid(True)
+
+    if to_call is not None:
+        to_call()
+
+    if show:
+        plt.show()
\ No newline at end of file
@@ -0,0 +1,131 @@
+"""
+Renders rough lock logs to image files without a display.
+
+Usage:
+
+    python render.py OUTPUT_FOLDER LOG [LOG ...] [--pdf FILE]
+"""
+import hashlib
+import argparse
+import numpy as np
+import matplotlib
+# has to happen before pyplot is imported
+matplotlib.use('Agg')
+from os import makedirs, path as os_path
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib import pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+from utils import line
+from plotting import plot_ramp
+from log_file import read_log, LogReader
+
+# increase if the plots change, this invalidates all rendered files
+RENDER_VERSION = 1
+
+
+def entry_hash(target_frequencies, item):
+    """
+    A hash of everything that influences the plot of a log entry.
+    """
+    h = hashlib.sha1(('%d' % RENDER_VERSION).encode())
+    h.update(np.asarray(target_frequencies, dtype=float).tobytes())
+    for part in item:
+        h.update(np.asarray(part, dtype=float).tobytes())
+    return h.hexdigest()[:12]
+
+
+def render_entry(target_frequencies, item, filename):
+    """
+    Plots a ramp or a fit entry of a log to `filename`.
+    """
+    plt.figure()
+
+    if len(item) == 2:
+        plt.plot(item[0], item[1])
+    else:
+        curr, freq, curr_interval, slope, shift = item
+        plot_ramp(
+            target_frequencies, curr, freq, curr_interval,
+            lambda x: line(x, slope, shift), show=False
+        )
+
+    plt.savefig(filename)
+    plt.close()
+    return filename
+
+
+def collect_entries(log_filenames, target_frequencies, output_folder):
+    """
+    Yields `(target_frequencies, item, image_filename)` for every ramp or
+    fit entry of the given logs.
+    """
+    for log_filename in log_filenames:
+        name = os_path.splitext(os_path.basename(log_filename))[0]
+        entries = read_log(log_filename)
+
+        targets = target_frequencies
+        if isinstance(entries, LogReader):
+            targets = entries.meta().get('target_frequencies', targets)
+
+        for idx, item in enumerate(entries):
+            if isinstance(item, str):
+                continue
+
+            image = os_path.join(
+                output_folder,
+                '%s-%04d-%s.png' % (name, idx, entry_hash(targets, item))
+            )
+            yield targets, item, image
+
+
+def render_logs(log_filenames, output_folder, target_frequencies=None,
+                pdf=None, processes=None):
+    """
+    Renders every ramp and fit entry of the given logs to PNG files in
+    `output_folder` using a process pool. Entries that were already rendered
+    (with the same data) are skipped.
+
+    Binary logs contain the target frequencies, for old JSON logs they have
+    to be given. If `pdf` is given, all images are collected in a
+    multi-page PDF file.
+
+    Returns the filenames of all images.
+    """
+    makedirs(output_folder, exist_ok=True)
+
+    entries = list(
+        collect_entries(log_filenames, target_frequencies, output_folder)
+    )
+    images = [image for _, _, image in entries]
+    todo = [entry for entry in entries if not os_path.exists(entry[2])]
+    print('rendering %d of %d entries' % (len(todo), len(entries)))
+
+    if todo:
+        with ProcessPoolExecutor(processes) as pool:
+            list(pool.map(render_entry, *zip(*todo)))
+
+    if pdf is not None:
+        with PdfPages(pdf) as pages:
+            for image in images:
+                fig = plt.figure()
+                plt.imshow(plt.imread(image))
+                plt.axis('off')
+                plt.title(os_path.basename(image), fontsize=8)
+                pages.savefig(fig)
+                plt.close(fig)
+
+    return images
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('output_folder')
+    parser.add_argument('logs', nargs='+')
+    parser.add_argument('--pdf')
+    parser.add_argument(
+        '--targets', nargs=2, type=float, default=None,
+        help='target frequencies for old JSON logs'
+    )
+    args = parser.parse_args()
+
+    render_logs(args.logs, args.output_folder, args.targets, pdf=args.pdf)
@@ -1,6 +1,6 @@
 import json
 import numpy as np
-from utils import replay
+from plotting import replay
 from ben.plot import plt, set_font_scale, save_ma
 from config import MODE_FREQUENCY_SPACING, TARGET_SLOPE
 
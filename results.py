@@ -0,0 +1,144 @@
+import json
+import sqlite3
+import numpy as np
+
+# the values that are recorded for every cell of a sweep
+RESULT_FIELDS = [
+    'data', 'max_miob_diffs', 'vhbg_change', 'vhbg_end', 'N_wiggles',
+    'N_temp_changes'
+]
+
+
+class ResultStore:
+    """
+    Append-only store for the results of a reliability sweep over start
+    temperatures (index `j`) and start currents (index `i`).
+
+    Every cell is written in a single transaction, i.e. a crash can't
+    corrupt results that were written before. The database uses SQLite's
+    write-ahead log, so the results can be read while a sweep is running.
+
+    Usage:
+
+        store = ResultStore('data.sqlite', temperatures, currents)
+        store.add(j, i, data=duration, vhbg_end=...)
+
+        # anywhere else, also during the sweep
+        data = ResultStore('data.sqlite').matrix('data')
+
+    A sweep can only be resumed with the grid it was started with, reopening
+    the store with another grid raises `ValueError`.
+    """
+    def __init__(self, filename, temperatures=None, currents=None):
+        self.filename = filename
+        # `timeout` allows concurrent access from several processes
+        self.db = sqlite3.connect(filename, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+
+        with self.db:
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS cells (j INTEGER, i INTEGER, '
+                'temperature REAL, current REAL, %s, PRIMARY KEY (j, i))' %
+                ', '.join('%s REAL' % name for name in RESULT_FIELDS)
+            )
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS grid (name TEXT PRIMARY KEY, '
+                'value TEXT)'
+            )
+
+            mismatch, new = None, []
+            for name, values in (('temperatures', temperatures),
+                                 ('currents', currents)):
+                if values is None:
+                    continue
+
+                values = [float(v) for v in values]
+                stored = self._grid(name)
+                if stored is None:
+                    new.append((name, json.dumps(values)))
+                elif len(stored) != len(values) or \
+                        not np.allclose(stored, values):
+                    mismatch = name
+
+            if mismatch is None:
+                self.db.executemany('INSERT INTO grid VALUES (?, ?)', new)
+
+        if mismatch is not None:
+            self.db.close()
+            raise ValueError(
+                '%s contains results for other %s' % (filename, mismatch)
+            )
+
+    def _grid(self, name):
+        row = self.db.execute(
+            'SELECT value FROM grid WHERE name = ?', (name,)
+        ).fetchone()
+        if row is not None:
+            return np.array(json.loads(row[0]))
+
+    @property
+    def temperatures(self):
+        return self._grid('temperatures')
+
+    @property
+    def currents(self):
+        return self._grid('currents')
+
+    @property
+    def shape(self):
+        temperatures, currents = self.temperatures, self.currents
+        if temperatures is not None and currents is not None:
+            return len(temperatures), len(currents)
+
+        max_j, max_i = self.db.execute(
+            'SELECT MAX(j), MAX(i) FROM cells'
+        ).fetchone()
+        return (max_j or 0) + 1, (max_i or 0) + 1
+
+    def add(self, j, i, temperature=None, current=None, **values):
+        """
+        Stores the result of a cell. Missing fields are stored as NULL.
+        """
+        unknown = set(values) - set(RESULT_FIELDS)
+        if unknown:
+            raise ValueError('unknown fields %s' % ', '.join(sorted(unknown)))
+
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO cells VALUES (?, ?, ?, ?, %s)' %
+                ', '.join('?' * len(RESULT_FIELDS)),
+                [int(j), int(i)] + [
+                    None if value is None else float(value)
+                    for value in (temperature, current)
+                ] + [
+                    None if values.get(name) is None else float(values[name])
+                    for name in RESULT_FIELDS
+                ]
+            )
+
+    def done(self):
+        """
+        Returns the indices `(j, i)` of all cells that have a result.
+        """
+        return set(self.db.execute('SELECT j, i FROM cells'))
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM cells').fetchone()[0]
+
+    def matrix(self, name):
+        """
+        Rebuilds the matrix of a single field. Cells without a result are 0.
+        """
+        assert name in RESULT_FIELDS, 'unknown field %s' % name
+        matrix = np.zeros(self.shape)
+        for j, i, value in self.db.execute(
+                'SELECT j, i, %s FROM cells WHERE %s IS NOT NULL' %
+                (name, name)):
+            matrix[j, i] = value
+        return matrix
+
+    def matrices(self):
+        return {name: self.matrix(name) for name in RESULT_FIELDS}
+
+    def close(self):
+        self.db.close()
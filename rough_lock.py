@@ -1,15 +1,25 @@
-import json
 import numpy as np
-from time import sleep
-from matplotlib import pyplot as plt
+from itertools import count
 from config import TARGET_SLOPE, CURRENT_LIMITS, MODE_FREQUENCY_SPACING, \
-    DELTA_MODES, RAMP_AMPLITUDE, CURRENT_MOD_FACTOR, TARGET_CURRENTS, \
-    MAX_TEMPERATURE, MIN_TEMPERATURE
-from utils import split_to_chunks, fit_line, greater, smaller, in_range, \
-    find_current_for_frequency, TemperatureOutOfBounds, NoSlope, NotReachable, \
-    line
+    RAMP_AMPLITUDE, CURRENT_MOD_FACTOR, MAX_TEMPERATURE, \
+    MIN_TEMPERATURE, MODE_TEMPERATURE_SPACING
+from utils import in_range, find_current_for_frequency, \
+    TemperatureOutOfBounds, NoSlope, NotReachable, line
+from fitting import find_mode_window, segment_ramp, IncrementalLineFit
+from log_file import LogWriter, LogReader
+from vhbg_model import ModeShiftModel
+from hop_strategy import HopStrategy
+from planner import plan_target_modes
+from tracing import span, traced, annotate
 
 DATA_FOLDER = '../../data/frequency_control/rough_lock/'
+# a segment has to contain at least this many points (and a third of the
+# ramp) in order to be accepted as a laser mode
+MIN_MODE_POINTS = 5
+MAX_FIT_ERROR = 1e-2
+# the acquisition of a ramp may stop after this many points if the slope is
+# already known well enough
+EARLY_STOP_POINTS = 64
 
 
 class RoughLock:
@@ -19,22 +29,41 @@ class RoughLock:
     def __init__(self, frequency_control):
         self.fc = frequency_control
         self.vhbg_temperatures = []
-        self.log_entries = []
+        self.log_writer = None
         self.temperature_ramp_direction = False
+        self.temperature_ramp_target = None
+        self.mode_shift_model = ModeShiftModel()
+        self.hop_strategy = frequency_control.hop_strategy or HopStrategy()
+        self.modes = []
+        self.hop_currents = []
 
+    @traced('rough_lock.start')
     def start(self):
         target_frequency = np.mean(self.fc.target_frequencies)
 
-        # record a current vs beat frequency diagram.
-        # if no straight line is found that fulfils the criteria for
-        # a laser mode, the current is wiggled up and down until a mode
-        # is found.
-        curr, freq, freq, curr_interval, freq_interval, slope, shift, \
-            N_wiggles = self.search_laser_mode()
+        cached = self.lookup_mode()
 
-        if self.fc.debug:
-            # save data for later analysis
-            self.log((list(curr), list(freq), list(curr_interval), slope, shift))
+        if cached is not None:
+            # we have recently seen the laser mode at this operating point,
+            # no need to search it
+            slope, shift = cached['slope'], cached['shift']
+            N_wiggles = 0
+            self.log('using cached mode')
+        else:
+            # record a current vs beat frequency diagram.
+            # if no straight line is found that fulfils the criteria for
+            # a laser mode, the current is wiggled up and down until a mode
+            # is found.
+            curr, freq, freq, curr_interval, freq_interval, slope, shift, \
+                N_wiggles = self.search_laser_mode()
+
+            self.remember_mode(
+                self.fc.start_temperature, slope, shift, self.hop_currents
+            )
+
+            if self.fc.debug:
+                # save data for later analysis
+                self.log((curr, freq, curr_interval, slope, shift))
 
         # pick a target mode and target current by extrapolating the
         # current mode and estimating which point could be reached
@@ -51,142 +80,254 @@ class RoughLock:
         error_counter = 0
         temp_ramp_started = False
         temperature_ramp_did_turn = False
+        # the last fitted mode (if the last measurement showed one)
+        fitted = (slope, shift)
 
         # this loop runs until rough lock is complete or has failed
-        while True:
-            if self.fc.debug:
-                # for debugging
-                #self.vhbg_temperatures.append(self.fc.electronics.get_vhbg_temperature())
-                #self.log('%.2fdeg' % self.vhbg_temperatures[-1])
-                pass
-
-            # tune the current to a value that is far away and return again
-            # by chosing the right current limit, we try to force a mode hop
-            # to the mode we want to reach
-            self.fc.laser_current = CURRENT_LIMITS[
-                1 if temp_direction < 0 else 0
-            ]
-            sleep(.3)
-            self.fc.laser_current = target_current
-            sleep(.7)
-
-            # record a current vs beat frequency diagram once again
-            curr, freq = self.fc.electronics.measure_frequencies(
-                self.fc.laser_current
-            )
-            # already prepare the ramp measurement of the next iteration
-            # this was added for a special combination of lab devices which
-            # require some time to prepare a ramp measurement
-            # --> this is not strictly necessary, but improves performance
-            self.fc.electronics.prepare_ramp_measurement()
-
-            # analyse the recorded data and try to find a slope corresponding
-            # to a laser mode
-            data = self.find_slope(curr, freq)
-
-            if data is None:
+        for N_iterations in count():
+            with span('rough_lock.iteration', iteration=N_iterations,
+                      delta_mode=delta_mode, current=target_current):
                 if self.fc.debug:
-                    self.log((list(curr), list(freq)))
-
-                # no slope found... this may happen if our beat note is close
-                # to 0 or too high for the counter
-                # --> start a temperature ramp (if it wasn't started before)
-                if not temp_ramp_started:
-                    self.ramp_temperature(temp_direction)
-                    temp_ramp_started = True
-
-                error_counter += 1
-                self.log('no laser mode found #%d' % error_counter)
-
-                if temperature_ramp_did_turn:
-                    if error_counter == 25:
-                        #  it's hopeless. We just don't find the laser mode again
-                        raise TemperatureOutOfBounds()
-                elif error_counter == 7:
-                    # we waited some time while ramping the VHBG temperature in
-                    # one direction but did not find a laser mode. Let's try to
-                    # go in the other direction.
-                    temp_direction *= -1
-                    self.ramp_temperature(temp_direction)
-                    temperature_ramp_did_turn = True
-                    error_counter = 0
-                    self.log('searching for a laser mode in the other vhbg direction')
-
-                continue
-
-            # if we are here, a laser mode was found!
-            error_counter = 0
-            temperature_ramp_did_turn = False
-
-            # unpack the data describing the current mode
-            freq, curr_interval, freq_interval, slope, shift = data
-            current_mode = lambda x: line(x, slope, shift)
+                    # for debugging
+                    #self.vhbg_temperatures.append(self.fc.electronics.get_vhbg_temperature())
+                    #self.log('%.2fdeg' % self.vhbg_temperatures[-1])
+                    pass
+
+                # tune the current to a value that is far away and return again
+                # by chosing the right direction, we try to force a mode hop
+                # to the mode we want to reach. The hop strategy knows how far
+                # we have to go.
+                direction = 1 if temp_direction < 0 else -1
+                excursion = None
+                amplitude_idx = -1
+                if fitted is not None:
+                    hops = self.hop_strategy.desired_hops(
+                        *fitted, target_current, target_frequency
+                    )
+                    amplitude_idx = self.hop_strategy.choose(direction, hops)
+                    excursion = (fitted, hops, amplitude_idx)
+                excursion_current = self.hop_strategy.excursion_current(
+                    target_current, direction, amplitude_idx
+                )
+                annotate(excursion=excursion_current - target_current)
 
-            if self.fc.debug:
-                # save data for later analysis
-                self.log((list(curr), list(freq), list(curr_interval), slope, shift))
-
-            # the data we recorded contains a laser mode, but may also contain
-            # some noisy data
-            # --> this is a hypothetic ideal mode
-            extrapolated = current_mode(curr)
-            freq_range = (min(extrapolated), max(extrapolated))
-            mean_freq = np.mean(freq_range)
-            center_frequency = current_mode(self.fc.laser_current)
-
-            # check whether both desired frequencies are within the current mode
-            if in_range(self.fc.target_frequencies[0], freq_range) and \
-                    in_range(self.fc.target_frequencies[1], freq_range):
-                # Yes! We're done!
-                self.ramp_temperature(False)
-                return N_temp_changes, N_wiggles
-
-            very_far_away = np.abs(center_frequency - target_frequency) > \
-                0.8 * MODE_FREQUENCY_SPACING
-
-            if very_far_away:
-                # we are too far from our target frequency in order to reach it
-                # without a mode hop. Start a VHBG temperature ramp in the right
-                # direction in order to move mode boundaries in our favor
-                if not temp_ramp_started:
-                    self.ramp_temperature(temp_direction)
-                    temp_ramp_started = True
-                else:
-                    if (mean_freq > 0 and temp_direction < 0) or \
-                       (mean_freq < 0 and temp_direction > 0):
-                        # apparently we are tuning the temperature in the wrong
-                        # direction
-                        self.log('change temperature direction')
+                self.fc.laser_current = excursion_current
+                self.fc.electronics.wait_for_stable_frequency(.3)
+                self.fc.laser_current = target_current
+                self.fc.electronics.wait_for_stable_frequency(.7)
+
+                # record a current vs beat frequency diagram once again
+                curr, freq = self.fc.electronics.measure_frequencies(
+                    self.fc.laser_current, estimator=self.new_estimator()
+                )
+                # already prepare the ramp measurement of the next iteration
+                # this was added for a special combination of lab devices which
+                # require some time to prepare a ramp measurement
+                # --> this is not strictly necessary, but improves performance
+                self.fc.electronics.prepare_ramp_measurement()
+
+                # analyse the recorded data and try to find a slope corresponding
+                # to a laser mode
+                data = self.find_slope(curr, freq)
+
+                if data is None:
+                    fitted = None
+                    if self.fc.debug:
+                        self.log((curr, freq))
+
+                    # no slope found... this may happen if our beat note is close
+                    # to 0 or too high for the counter
+                    # --> start a temperature ramp (if it wasn't started before)
+                    if not temp_ramp_started:
+                        self.ramp_temperature(temp_direction)
+                        temp_ramp_started = True
+
+                    error_counter += 1
+                    self.log('no laser mode found #%d' % error_counter)
+
+                    if temperature_ramp_did_turn:
+                        if error_counter == 25:
+                            #  it's hopeless. We just don't find the laser mode again
+                            raise TemperatureOutOfBounds()
+                    elif error_counter == 7:
+                        # we waited some time while ramping the VHBG temperature in
+                        # one direction but did not find a laser mode. Let's try to
+                        # go in the other direction.
                         temp_direction *= -1
                         self.ramp_temperature(temp_direction)
-            else:
-                # we are not very far away from our target frequency,
-                # it may be reached by setting the MO current.
-                # Try it out!
-                self.ramp_temperature(False)
-                target_current = find_current_for_frequency(
-                    target_frequency, slope, shift
-                )
+                        temperature_ramp_did_turn = True
+                        error_counter = 0
+                        self.log('searching for a laser mode in the other vhbg direction')
+
+                    continue
+
+                # if we are here, a laser mode was found!
+                error_counter = 0
+                temperature_ramp_did_turn = False
+
+                # unpack the data describing the current mode
+                freq, curr_interval, freq_interval, slope, shift = data
+                current_mode = lambda x: line(x, slope, shift)
+
+                # did the excursion bring us to the desired mode?
+                if excursion is not None:
+                    before, hops, amplitude_idx = excursion
+                    self.hop_strategy.add(
+                        direction, hops, amplitude_idx,
+                        self.hop_strategy.hops(
+                            before, (slope, shift), target_current
+                        ) == hops
+                    )
+                fitted = (slope, shift)
+
+                # learn how the mode shifts with VHBG temperature
+                temperature = self.fc.electronics.get_vhbg_temperature()
+                self.mode_shift_model.add(temperature, slope, shift)
+                self.remember_mode(temperature, slope, shift, self.hop_currents)
+
+                if self.fc.debug:
+                    # save data for later analysis
+                    self.log((curr, freq, curr_interval, slope, shift))
+
+                # the data we recorded contains a laser mode, but may also contain
+                # some noisy data
+                # --> this is a hypothetic ideal mode. The acquisition may have
+                # stopped early, the mode is extrapolated over the whole ramp.
+                extrapolated = current_mode(np.array(
+                    self.fc.electronics.ramp_current_range(self.fc.laser_current)
+                ))
+                freq_range = (min(extrapolated), max(extrapolated))
+                mean_freq = np.mean(freq_range)
+                center_frequency = current_mode(self.fc.laser_current)
+                annotate(slope=slope, frequency=center_frequency)
+
+                # check whether all desired frequencies are within the current mode
+                if all(
+                    in_range(f, freq_range) for f in self.fc.target_frequencies
+                ):
+                    # Yes! We're done!
+                    self.ramp_temperature(False)
+                    return N_temp_changes, N_wiggles
+
+                very_far_away = np.abs(center_frequency - target_frequency) > \
+                    0.8 * MODE_FREQUENCY_SPACING
+
+                if very_far_away:
+                    # we are too far from our target frequency in order to reach it
+                    # without a mode hop. Start a VHBG temperature ramp in the right
+                    # direction in order to move mode boundaries in our favor
+                    if not temp_ramp_started:
+                        self.ramp_temperature(temp_direction)
+                        temp_ramp_started = True
+                    else:
+                        if (mean_freq > 0 and temp_direction < 0) or \
+                           (mean_freq < 0 and temp_direction > 0):
+                            # apparently we are tuning the temperature in the wrong
+                            # direction
+                            self.log('change temperature direction')
+                            temp_direction *= -1
+                            self.ramp_temperature(temp_direction)
+
+                    # instead of ramping to the temperature limit, go directly to
+                    # the temperature at which we expect the target frequency.
+                    # If the prediction is uncertain by a mode or more, it
+                    # isn't better than the ramp to the limit
+                    prediction = self.mode_shift_model.target_temperature(
+                        temperature, center_frequency, target_frequency
+                    )
+                    if prediction is not None:
+                        target_temperature, band = prediction
+                        if band < MODE_TEMPERATURE_SPACING and \
+                                np.sign(target_temperature - temperature) == \
+                                temp_direction:
+                            self.ramp_temperature(
+                                temp_direction, target_temperature
+                            )
+                else:
+                    # we are not very far away from our target frequency,
+                    # it may be reached by setting the MO current.
+                    # Try it out!
+                    self.ramp_temperature(False)
+                    target_current = find_current_for_frequency(
+                        target_frequency, slope, shift
+                    )
 
     def cleanup(self):
         """
-        Save log file for later debugging.
+        Finish the log file for later debugging.
         """
-        sc = self.fc.start_current
-        st = self.fc.start_temperature
-        f = open(DATA_FOLDER + 'data-%.2f-%.2f.json' % (st, sc), 'w')
-        json.dump({
-            'start_current': sc,
-            'start_temperature': st,
+        if self.log_writer is None:
+            return
+
+        self.log_writer.write_meta({
+            'start_current': self.fc.start_current,
+            'start_temperature': self.fc.start_temperature,
+            'target_frequencies': list(self.fc.target_frequencies),
             'vhbg_temperatures': self.vhbg_temperatures,
-            'log': self.log_entries
-        }, f)
-        f.close()
+        })
+        self.log_writer.close()
+
+    @property
+    def log_filename(self):
+        filename = 'data-%.2f-%.2f.rlog' % (
+            self.fc.start_temperature, self.fc.start_current
+        )
+        if self.fc.name is not None:
+            filename = '%s-%s' % (self.fc.name, filename)
+        return DATA_FOLDER + filename
+
+    @property
+    def log_entries(self):
+        """
+        Lazily iterates over everything that was logged so far.
+        """
+        if self.log_writer is None:
+            return []
+
+        self.log_writer.flush()
+        return LogReader(self.log_writer.filename)
 
     def log(self, item):
         if isinstance(item, str):
             print(item)
-        self.log_entries.append(item)
+
+        if self.log_writer is None:
+            self.log_writer = LogWriter(
+                self.log_filename, clock=self.fc.electronics.time
+            )
+        self.log_writer.write(item)
+
+    def lookup_mode(self):
+        """
+        Returns the cached mode at the start operating point, if there is a
+        recent one.
+        """
+        if self.fc.mode_cache is None:
+            return
+
+        return self.fc.mode_cache.lookup(
+            self.fc.start_temperature, self.fc.laser_current
+        )
+
+    def remember_mode(self, temperature, slope, shift, boundaries):
+        """
+        Stores a fitted mode in the mode cache.
+        """
+        if self.fc.mode_cache is None:
+            return
+
+        self.fc.mode_cache.update(
+            temperature, self.fc.laser_current, slope, shift, boundaries
+        )
+
+    def new_estimator(self):
+        """
+        Returns an incremental fit that allows the electronics to stop the
+        acquisition of a ramp as soon as its slope is known.
+        """
+        return IncrementalLineFit(
+            self.is_good_slope, MAX_FIT_ERROR, EARLY_STOP_POINTS
+        )
 
     def is_good_slope(self, m):
         """
@@ -210,25 +351,60 @@ class RoughLock:
             if low - (RAMP_AMPLITUDE * CURRENT_MOD_FACTOR) > CURRENT_LIMITS[0]:
                 yield low
 
+    @traced('rough_lock.find_slope')
     def find_slope(self, curr, freq):
         """
-        Splits data into segments and checks for each segment whether a
-        line with the right slope for a laser mode is visible.
+        Splits the data at mode hops into linear segments and picks the
+        longest segment that shows a line with the right slope for a laser
+        mode. If this fails, e.g. because of a lot of noise, the longest
+        window with the right slope is searched.
+
+        All usable modes of the ramp are stored in `self.modes`, the currents
+        at which mode hops occurred in `self.hop_currents`.
         """
-        chunks = split_to_chunks(curr, freq)
-        for i, [curr_interval, freq_interval] in enumerate(chunks):
-            mirror, slope, shift, err = fit_line(curr_interval, freq_interval)
-            current_mode = lambda x: line(x, slope, shift)
+        min_length = max(MIN_MODE_POINTS, len(curr) // 3)
+
+        segments, self.hop_currents = segment_ramp(
+            curr, freq, min_length=MIN_MODE_POINTS
+        )
+        self.modes = [
+            segment for segment in segments
+            if self.is_good_slope(segment.slope) and segment.err < MAX_FIT_ERROR
+        ]
+        long_modes = [
+            segment for segment in self.modes
+            if len(segment.inliers) >= min_length
+        ]
+
+        if long_modes:
+            mode = max(long_modes, key=lambda segment: len(segment.inliers))
+            start, stop, mirror, slope, shift, err = mode.start, mode.stop, \
+                mode.mirror, mode.slope, mode.shift, mode.err
+        else:
+            window = find_mode_window(
+                curr, freq, self.is_good_slope, MAX_FIT_ERROR,
+                min_length=min_length
+            )
+            if window is None:
+                return
+
+            start, stop, mirror, slope, shift, err = window
 
-            print(slope)
+        print(slope)
+        annotate(
+            slope=slope, fit_error=err, points=stop - start,
+            segments=len(segments), hops=len(self.hop_currents)
+        )
 
-            if self.is_good_slope(slope) and err < 1e-2:
-                if mirror:
-                    freq_interval = -1 * np.array(freq_interval)
-                    freq = -1 * np.array(freq)
+        curr_interval = curr[start:stop]
+        freq_interval = freq[start:stop]
+        if mirror:
+            freq_interval = -1 * np.array(freq_interval)
+            freq = -1 * np.array(freq)
 
-                return freq, curr_interval, freq_interval, slope, shift
+        return freq, curr_interval, freq_interval, slope, shift
 
+    @traced('rough_lock.search_laser_mode')
     def search_laser_mode(self):
         """
         Checks whether we see a laser mode. If no, wiggles the current
@@ -239,10 +415,10 @@ class RoughLock:
         for N_wiggles, current in enumerate(currents):
             if N_wiggles != 0:
                 self.fc.laser_current = current
-                sleep(0.5)
+                self.fc.electronics.wait_for_stable_frequency(0.5)
 
             curr, freq = self.fc.electronics.measure_frequencies(
-                self.fc.laser_current
+                self.fc.laser_current, estimator=self.new_estimator()
             )
 
             self.fc.electronics.prepare_ramp_measurement()
@@ -253,7 +429,7 @@ class RoughLock:
                 break
 
             self.log('no slope found')
-            self.log((list(curr), list(freq)))
+            self.log((curr, freq))
         else:
             raise NoSlope()
 
@@ -265,69 +441,54 @@ class RoughLock:
 
     def determine_target_mode(self, slope, shift):
         """
-        Extrapolates the current mode and estimates which mode could be suitable
-        for reaching both desired frequencies.
+        Extrapolates the current mode to the neighbouring modes and picks the
+        one that is expected to reach all desired frequencies fastest.
         """
-        # iterate over possible modes, starting with the current one
-        # (delta=0) first
-        for delta_mode in DELTA_MODES:
-            # find the offset of the mode
-            mode_shift = shift - (delta_mode * MODE_FREQUENCY_SPACING)
-
-            # extrapolate the mode in question and check which currents would
-            # be needed to reach the desired frequencies
-            target_currents = [
-                find_current_for_frequency(f, slope, mode_shift)
-                for f in self.fc.target_frequencies
-            ]
-            # are these currents allowed?
-            currents_valid = [
-                in_range(c, TARGET_CURRENTS) for c in target_currents
-            ]
-
-            if currents_valid[0] and currents_valid[1]:
-                # the currents are allowed, we now have a new target mode
-                self.log(
-                    'target currents are %.2f and %.2f' % \
-                    tuple(sorted(target_currents))
-                )
-
-                target_current = np.mean(target_currents)
+        plans = plan_target_modes(
+            slope, shift, self.fc.target_frequencies, self.fc.start_current
+        )
+        if not plans:
+            raise NotReachable()
 
-                if delta_mode == 0:
-                    # we want to stay in the current mode
-                    # ramp the vhbg temperature in a direction that shifts
-                    # the mode in the right direction
-                    temp_ramp_direction = 1 \
-                        if target_current - self.fc.start_current > 0 \
-                        else -1
-                else:
-                    # we want to go to a different mode
-                    # ramp the vhbg temperature in a direction that will
-                    # eventually allow us to reach it
-                    temp_ramp_direction = 1 if delta_mode > 0 else -1
+        plan = plans[0]
+        self.log('target currents are %s' % ', '.join(
+            '%.2f' % c for c in sorted(plan.target_currents)
+        ))
 
-                return delta_mode, target_current, temp_ramp_direction
-        else:
-            raise NotReachable()
+        return plan.delta_mode, plan.target_current, plan.temp_direction
 
-    def ramp_temperature(self, temp_direction):
+    @traced('rough_lock.ramp_temperature')
+    def ramp_temperature(self, temp_direction, target=None):
         """
-        Start a vhbg temperature ramp.
+        Start a vhbg temperature ramp. If no `target` temperature is given,
+        the temperature is ramped to its limit.
         """
-        self.log('ramp temperature, direction %d' % temp_direction)
+        if target is not None:
+            target = np.clip(target, MIN_TEMPERATURE, MAX_TEMPERATURE)
+            if target == self.fc.vhbg_target_temperature:
+                return
+            self.log('ramp temperature to %.2f' % target)
+        else:
+            self.log('ramp temperature, direction %d' % temp_direction)
 
         if not temp_direction:
             if self.temperature_ramp_direction:
-                temp_correction  = -.5 * self.temperature_ramp_direction
+                # a ramp to the limit overshoots. A ramp to a predicted
+                # target slows down before, i.e. it stays where it is.
+                temp_correction = 0
+                if self.temperature_ramp_target is None:
+                    temp_correction  = -.5 * self.temperature_ramp_direction
 
                 self.log('correct %.2f' % temp_correction)
 
                 self.fc.vhbg_target_temperature = \
                     self.fc.electronics.get_vhbg_temperature() + temp_correction
+        elif target is not None:
+            self.fc.vhbg_target_temperature = target
         else:
             sign = temp_direction
             self.fc.vhbg_target_temperature = \
                 MAX_TEMPERATURE if sign > 0 else MIN_TEMPERATURE
 
         self.temperature_ramp_direction = temp_direction
+        self.temperature_ramp_target = target
@@ -0,0 +1,142 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from traceback import print_exc
+from control import FrequencyControl
+from utils import TemperatureOutOfBounds, NoSlope, NotReachable
+from results import ResultStore
+
+DATA_FOLDER = '../../data/frequency_control/'
+
+NO_SLOPE = -1
+TEMPERATURE_OUT_OF_BOUNDS = -2
+NOT_REACHABLE = -3
+LOCK_FAILED = -4
+
+
+def run_cell(electronics, target_frequencies, temperature, current,
+             miob_samples=10, name=None):
+    """
+    Performs a single rough lock and returns a dictionary describing the
+    result. `duration` is negative if the rough lock failed.
+
+    Afterwards, the MIOB temperature is sampled `miob_samples` times, this
+    needs the `miob` of the electronics. `name` is passed to the
+    `FrequencyControl`.
+    """
+    fc = FrequencyControl(
+        electronics, target_frequencies, current, temperature, name=name
+    )
+    if miob_samples:
+        target_temp = fc.electronics.miob.get_target_temperature()
+
+    N_temp_changes, N_wiggles = 0, 0
+
+    fc.prepare()
+    t1 = fc.electronics.time()
+    try:
+        N_temp_changes, N_wiggles = fc.do_rough_lock()
+    except NoSlope:
+        duration = NO_SLOPE
+    except TemperatureOutOfBounds:
+        duration = TEMPERATURE_OUT_OF_BOUNDS
+    except NotReachable:
+        duration = NOT_REACHABLE
+    else:
+        duration = fc.electronics.time() - t1
+
+    # check whether the MIOB temperature was disturbed
+    max_miob_diff = 0
+    for _ in range(miob_samples):
+        temp_diff = np.abs(
+            fc.electronics.miob.get_temperature() - target_temp
+        )
+        max_miob_diff = max(max_miob_diff, temp_diff)
+        fc.electronics.sleep(1)
+
+    vhbg_end = fc.electronics.get_vhbg_temperature()
+
+    try:
+        fc.cleanup()
+    except Exception:
+        pass
+
+    return {
+        'data': duration,
+        'max_miob_diffs': max_miob_diff,
+        'vhbg_end': vhbg_end,
+        'vhbg_change': np.abs(temperature - vhbg_end),
+        'N_wiggles': N_wiggles,
+        'N_temp_changes': N_temp_changes,
+    }
+
+
+def _run_cell(j, i, *args):
+    result = run_cell(*args)
+    result.update({'j': j, 'i': i})
+    return result
+
+
+def run_sweep(electronics, target_frequencies, temperatures, currents,
+              filename, processes=None):
+    """
+    Performs a rough lock for every combination of start temperature and
+    start current.
+
+    The cells are run in a process pool, i.e. `electronics` has to be
+    picklable (a class or a `functools.partial`). This only makes sense for
+    backends that don't need the real laser, e.g. `SimulatedElectronics`.
+
+    Every result is written to the `ResultStore` at `filename` as soon as
+    it is available. Cells that are already contained in the store are
+    skipped, i.e. an interrupted sweep can be resumed by calling this
+    function again.
+    """
+    store = ResultStore(filename, temperatures, currents)
+    done = store.done()
+    cells = [
+        (j, i, temperature, current)
+        for j, temperature in enumerate(temperatures)
+        for i, current in enumerate(currents)
+        if (j, i) not in done
+    ]
+    print('%d cells done, %d to go' % (len(done), len(cells)))
+
+    with ProcessPoolExecutor(processes) as pool:
+        futures = {
+            pool.submit(
+                _run_cell, j, i, electronics, target_frequencies,
+                temperature, current
+            ): (j, i)
+            for j, i, temperature, current in cells
+        }
+
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception:
+                print('EXC', futures[future])
+                print_exc()
+                continue
+
+            j, i = futures[future]
+            store.add(
+                temperature=temperatures[j], current=currents[i], **result
+            )
+
+    matrices = store.matrices()
+    store.close()
+    return matrices
+
+
+if __name__ == '__main__':
+    from functools import partial
+    from ben.frequency_control.electronics.simulated import SimulatedElectronics
+
+    matrices = run_sweep(
+        partial(SimulatedElectronics, seed=0),
+        [2.4e9, 4.4e9],
+        np.linspace(22.3, 27.5, 10),
+        np.linspace(100, 125, 25),
+        DATA_FOLDER + 'sweep.sqlite'
+    )
+    print(matrices['data'])
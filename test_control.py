@@ -4,16 +4,11 @@ from control import FrequencyControl
 from ben.frequency_control.electronics.ilx_rp_cnt90 import ILXRedPitayaCnt90Electronics
 from ben.frequency_control.electronics.tbus import TBusElectronics
 from utils import TemperatureOutOfBounds, NoSlope, NotReachable
-import pickle
+from sweep import DATA_FOLDER, NO_SLOPE, TEMPERATURE_OUT_OF_BOUNDS, \
+    NOT_REACHABLE, LOCK_FAILED
+from results import ResultStore
 from traceback import print_exc
 
-DATA_FOLDER = '../../data/frequency_control/'
-
-NO_SLOPE = -1
-TEMPERATURE_OUT_OF_BOUNDS = -2
-NOT_REACHABLE = -3
-LOCK_FAILED = -4
-
 
 def test_control():
     N_currents = 25
@@ -49,26 +44,17 @@ def test_control():
     N_wiggles_matrix = np.zeros((N_temperatures, N_currents))
     N_temp_changes_matrix = np.zeros((N_temperatures, N_currents))
 
-    def write_data():
-        f = open(DATA_FOLDER + 'data.pickle', 'wb')
-        pickle.dump({
-            'vhbg_end': vhbg_end,
-            'vhbg_change': vhbg_change,
-            'max_miob_diffs': max_miob_diffs,
-            'data': data,
-            'currents': currents,
-            'temperatures': temperatures,
-            'N_wiggles': N_wiggles_matrix,
-            'N_temp_changes': N_temp_changes_matrix
-        }, f)
-        f.close()
+    store = ResultStore(
+        DATA_FOLDER + 'data.sqlite', temperatures, currents
+    )
+    done = store.done()
 
     try:
         for j, temp in temperatures_and_idxs:
             print('TEMPERATURE', j, temp)
             for i, current in enumerate(currents):
                 print('RUN, i=', i, 'j=', j)
-                if data[j, i] != 0:
+                if (j, i) in done:
                     print('skip')
                     continue
 
@@ -122,7 +108,15 @@ def test_control():
                 except:
                     pass
 
-                write_data()
+                store.add(
+                    j, i, temp, current,
+                    data=duration,
+                    max_miob_diffs=max_miob_diff,
+                    vhbg_end=v,
+                    vhbg_change=vhbg_change[j, i],
+                    N_wiggles=N_wiggles_matrix[j, i],
+                    N_temp_changes=N_temp_changes_matrix[j, i]
+                )
 
     except Exception as e:
         print('EXC')
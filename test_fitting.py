@@ -0,0 +1,56 @@
+import numpy as np
+from config import TARGET_SLOPE, MODE_FREQUENCY_SPACING
+from fitting import segment_ramp
+
+CURRENTS = np.linspace(100, 115, 128)
+NOISE_LEVELS = [0.5e6, 1e6, 2e6, 5e6]
+
+
+def test_zero_crossing_is_no_hop():
+    rng = np.random.default_rng(0)
+    for noise in NOISE_LEVELS:
+        # the counter sees the absolute value of the beat note
+        frequencies = np.abs(TARGET_SLOPE * (CURRENTS - 104)) + \
+            rng.normal(0, noise, len(CURRENTS))
+        segments, hop_currents = segment_ramp(CURRENTS, frequencies)
+
+        assert hop_currents == []
+        assert [segment.mirror for segment in segments] == [False, True]
+        # the mirrored part is kept
+        assert sum(len(segment.inliers) for segment in segments) >= 120
+        for segment in segments:
+            assert abs(segment.slope / TARGET_SLOPE - 1) < 0.05
+
+
+def test_mode_hop():
+    rng = np.random.default_rng(1)
+    for noise in NOISE_LEVELS:
+        frequencies = TARGET_SLOPE * (CURRENTS - 100) + 3e9
+        frequencies[60:] += MODE_FREQUENCY_SPACING
+        frequencies += rng.normal(0, noise, len(CURRENTS))
+        segments, hop_currents = segment_ramp(CURRENTS, frequencies)
+
+        assert len(hop_currents) == 1
+        assert CURRENTS[59] < hop_currents[0] < CURRENTS[60]
+        assert [(segment.start, segment.stop) for segment in segments] == \
+            [(0, 60), (60, 128)]
+
+
+def test_falling_and_rising_flank():
+    rng = np.random.default_rng(2)
+    falling = np.linspace(109, 91, 61)
+    rising = np.linspace(91, 109, 40)[1:]
+    currents = np.concatenate([falling, rising])
+    # the mode hops at different currents on both flanks (hysteresis)
+    frequencies = TARGET_SLOPE * (currents - 100) + 3e9
+    other_mode = np.concatenate([falling < 102, rising < 104])
+    frequencies[other_mode] += MODE_FREQUENCY_SPACING
+    frequencies += rng.normal(0, 1e6, len(currents))
+
+    segments, hop_currents = segment_ramp(currents, frequencies)
+
+    assert len(hop_currents) == 2
+    # the mode around the turning point is fitted on both flanks
+    longest = max(segments, key=lambda segment: len(segment.inliers))
+    assert longest.start < 61 < longest.stop
+    assert len(longest.inliers) == np.sum(other_mode)
@@ -0,0 +1,42 @@
+from hop_strategy import HopStrategy, AMPLITUDES, PROBE_AFTER_SUCCESSES
+
+FULL_EXCURSION = len(AMPLITUDES) - 1
+
+
+def test_fresh_strategy_uses_full_excursion():
+    strategy = HopStrategy()
+    for direction in (-1, 1):
+        for hops in (-1, 0, 1):
+            assert strategy.choose(direction, hops) == FULL_EXCURSION
+
+
+def test_smaller_excursion_is_probed_after_successes():
+    strategy = HopStrategy()
+    for i in range(PROBE_AFTER_SUCCESSES):
+        assert strategy.choose(1, 1) == FULL_EXCURSION
+        strategy.add(1, 1, FULL_EXCURSION, True)
+
+    probed = strategy.choose(1, 1)
+    assert probed == FULL_EXCURSION - 1
+
+    # the probe succeeded, i.e. it is used from now on
+    strategy.add(1, 1, probed, True)
+    assert strategy.choose(1, 1) == probed
+    # ... but the other direction is still unknown
+    assert strategy.choose(-1, 1) == FULL_EXCURSION
+
+
+def test_failed_probe_is_not_repeated():
+    strategy = HopStrategy()
+    for i in range(PROBE_AFTER_SUCCESSES):
+        strategy.add(1, 1, FULL_EXCURSION, True)
+
+    strategy.add(1, 1, FULL_EXCURSION - 1, False)
+    assert strategy.choose(1, 1) == FULL_EXCURSION
+
+
+def test_far_modes_use_full_excursion():
+    strategy = HopStrategy()
+    for i in range(10):
+        strategy.add(1, 3, 0, True)
+    assert strategy.choose(1, 3) == FULL_EXCURSION
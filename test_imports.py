@@ -0,0 +1,38 @@
+import sys
+import subprocess
+from os import path as os_path
+from benchmark import IMPORT_BUDGET
+
+PACKAGE_FOLDER = os_path.dirname(os_path.abspath(__file__))
+# plotting and device drivers must not be loaded by importing the tuner, it
+# has to work headless and without the instruments
+FORBIDDEN_MODULES = [
+    'matplotlib', 'seaborn', 'scipy', 'plumbum', 'ben.plot', 'ben.devices',
+    'ben.control'
+]
+
+
+def imported_modules(modules):
+    """
+    Imports `modules` in a fresh interpreter and returns the import time and
+    all modules that were loaded.
+    """
+    script = '\n'.join([
+        'import sys',
+        'from time import perf_counter',
+        'start = perf_counter()',
+        'import %s' % ', '.join(modules),
+        'print(perf_counter() - start)',
+        'print("\\n".join(sys.modules))',
+    ])
+    output = subprocess.check_output(
+        [sys.executable, '-c', script], cwd=PACKAGE_FOLDER
+    )
+    duration, *loaded = output.decode().split()
+    return float(duration), set(loaded)
+
+
+def test_tuner_import_is_headless():
+    duration, loaded = imported_modules(['rough_lock', 'control'])
+    assert [name for name in FORBIDDEN_MODULES if name in loaded] == []
+    assert duration < IMPORT_BUDGET
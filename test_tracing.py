@@ -0,0 +1,23 @@
+import json
+import numpy as np
+from tracing import Tracer
+
+
+def reject_constant(name):
+    raise ValueError('%s is not valid JSON' % name)
+
+
+def test_chrome_trace_is_valid_json(tmp_path):
+    tracer = Tracer()
+    with tracer.span('iteration', excursion=np.inf, slope=np.float64(-2e8)):
+        pass
+    with tracer.span('fit', error=float('nan'), points=np.int64(5)):
+        pass
+
+    filename = str(tmp_path / 'trace.json')
+    tracer.save_chrome_trace(filename)
+    with open(filename) as f:
+        events = json.load(f, parse_constant=reject_constant)['traceEvents']
+
+    assert events[0]['args'] == {'excursion': 'inf', 'slope': -2e8}
+    assert events[1]['args'] == {'error': 'nan', 'points': 5}
@@ -0,0 +1,27 @@
+import numpy as np
+from utils import find_ramps, find_negative_ramp
+
+PERIOD = 122
+
+
+def triangle(n_points, phase):
+    t = np.arange(n_points) / PERIOD + phase
+    return np.abs((t + 0.5) % 1 - 0.5) * 2
+
+
+def test_flanks_start_at_turning_points():
+    ramp = triangle(200, 0.4)
+    # maxima at 12 and 134, minima at 73 and 195
+    assert find_ramps(ramp) == [
+        (slice(12, 73), -1), (slice(73, 134), 1), (slice(134, 195), -1)
+    ]
+    assert find_negative_ramp(ramp) == slice(12, 73)
+
+
+def test_flanks_of_noisy_ramp():
+    rng = np.random.default_rng(0)
+    ramp = triangle(200, 0.4) + rng.normal(0, 0.002, 200)
+    flanks = find_ramps(ramp)
+    assert [direction for _, direction in flanks] == [-1, 1, -1]
+    for (slice_, _), turn in zip(flanks, [12, 73, 134]):
+        assert abs(slice_.start - turn) <= 1
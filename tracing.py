@@ -0,0 +1,253 @@
+"""
+Records spans (named, timed sections with attributes) of the lock pipeline.
+
+Tracing is off by default and then costs only a global lookup per span.
+
+Usage:
+
+    fctl = FrequencyControl(
+        lambda: TracedElectronics(TBusElectronics()),
+        ...
+    )
+    tracer = enable_tracing(clock=fctl.electronics.time)
+    fctl.prepare()
+    fctl.do_rough_lock()
+    tracer.save_chrome_trace('trace.json')  # open with chrome://tracing
+    print(tracer.report())
+"""
+import json
+import threading
+import numpy as np
+from time import perf_counter
+from functools import wraps
+from wrapper import ElectronicsWrapper
+
+# the clock used for new tracers
+DEFAULT_CLOCK = perf_counter
+HISTOGRAM_BINS = 20
+# electronics calls that are too frequent and short to be worth a span
+NOT_TRACED = {'time', 'ramp_current_range'}
+
+_tracer = None
+
+
+class _NullSpan:
+    """
+    Returned by `span` if tracing is off.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    def __init__(self, tracer, name, category, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.tracer._active().append(self)
+        self.start = self.tracer.clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = self.tracer.clock() - self.start
+        self.tracer._active().pop()
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        self.tracer._record(self)
+        return False
+
+    def set(self, **attributes):
+        """
+        Adds attributes that are only known after the span was started.
+        """
+        self.attributes.update(attributes)
+
+
+class Tracer:
+    """
+    Collects finished spans. `clock` should be the clock of the electronics
+    backend, i.e. simulated runs are traced in virtual time.
+    """
+    def __init__(self, clock=DEFAULT_CLOCK):
+        self.clock = clock
+        self.spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def span(self, name, category='lock', **attributes):
+        return Span(self, name, category, attributes)
+
+    def _active(self):
+        """
+        The stack of spans that are open in this thread.
+        """
+        if not hasattr(self._local, 'spans'):
+            self._local.spans = []
+        return self._local.spans
+
+    def _record(self, span):
+        with self._lock:
+            self.spans.append((
+                span.name, span.category, span.start, span.duration,
+                threading.get_ident(), span.attributes
+            ))
+
+    def durations(self):
+        """
+        Returns a dict mapping span names to arrays of durations.
+        """
+        durations = {}
+        for name, _, _, duration, _, _ in self.spans:
+            durations.setdefault(name, []).append(duration)
+        return {name: np.array(d) for name, d in durations.items()}
+
+    def histograms(self, bins=HISTOGRAM_BINS):
+        """
+        Returns a dict mapping span names to `(counts, bin_edges)` of their
+        durations.
+        """
+        return {
+            name: np.histogram(durations, bins=bins)
+            for name, durations in self.durations().items()
+        }
+
+    def report(self):
+        """
+        A table of the total, mean and maximum durations per span name,
+        sorted by total duration.
+        """
+        rows = sorted(
+            self.durations().items(), key=lambda item: -np.sum(item[1])
+        )
+        lines = ['%-40s %6s %10s %10s %10s' % (
+            'span', 'count', 'total/s', 'mean/s', 'max/s'
+        )]
+        for name, durations in rows:
+            lines.append('%-40s %6d %10.3f %10.4f %10.4f' % (
+                name, len(durations), np.sum(durations), np.mean(durations),
+                np.max(durations)
+            ))
+        return '\n'.join(lines)
+
+    def chrome_trace(self):
+        """
+        The spans in the Chrome trace event format.
+        """
+        return {
+            'traceEvents': [
+                {
+                    'name': name,
+                    'cat': category,
+                    'ph': 'X',
+                    'ts': start * 1e6,
+                    'dur': duration * 1e6,
+                    'pid': 0,
+                    'tid': thread,
+                    'args': {
+                        key: _to_json(value)
+                        for key, value in attributes.items()
+                    },
+                }
+                for name, category, start, duration, thread, attributes
+                in self.spans
+            ],
+            'displayTimeUnit': 'ms',
+        }
+
+    def save_chrome_trace(self, filename):
+        with open(filename, 'w') as f:
+            # infinity and NaN would make the file invalid JSON
+            json.dump(self.chrome_trace(), f, allow_nan=False)
+
+
+def _to_json(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return repr(value)
+    if isinstance(value, (bool, int, float, str)) or value is None:
+        return value
+    return repr(value)
+
+
+def enable_tracing(clock=DEFAULT_CLOCK):
+    """
+    Starts recording spans with a new tracer and returns it.
+    """
+    global _tracer
+    _tracer = Tracer(clock)
+    return _tracer
+
+
+def disable_tracing():
+    """
+    Stops recording spans and returns the tracer.
+    """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+def span(name, category='lock', **attributes):
+    """
+    Context manager recording a span, if tracing is on.
+    """
+    if _tracer is None:
+        return NULL_SPAN
+    return _tracer.span(name, category, **attributes)
+
+
+def annotate(**attributes):
+    """
+    Adds attributes to the innermost open span of this thread, if tracing
+    is on.
+    """
+    if _tracer is None:
+        return
+
+    active = _tracer._active()
+    if active:
+        active[-1].set(**attributes)
+
+
+def traced(name):
+    """
+    Decorator recording a span for every call of the function.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _tracer.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TracedElectronics(ElectronicsWrapper):
+    """
+    Wraps an electronics backend and records a span for every device call
+    and every sleep, if tracing is on.
+    """
+    NOT_WRAPPED = NOT_TRACED
+
+    def _call(self, name, method, args, kwargs):
+        with span('electronics.' + name, 'device'):
+            return method(*args, **kwargs)
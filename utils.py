@@ -1,10 +1,19 @@
 import numpy as np
 from time import sleep, time
-from scipy.optimize import curve_fit
-from ben.devices import DLLException
-from matplotlib import pyplot as plt
-from config import CURRENT_LIMITS, DELTA_MODES, MODE_FREQUENCY_SPACING
-import seaborn as sns
+from config import SETTLE_TOLERANCE
+from fitting import fit_lines, relative_error
+
+# minimum and maximum time between two temperature readings
+POLL_INTERVALS = (0.05, 2) # s
+# poll again after this fraction of the predicted remaining time
+POLL_FRACTION = 0.25
+# number of readings used for predicting the remaining time
+TEMPERATURE_TRACE_LENGTH = 10
+STABLE_TEMPERATURE_TIMEOUT = 300 # s
+# minimum time between two reports of the remaining time
+REPORT_INTERVAL = 5 # s
+MAX_BUS_ERRORS = 10
+
 
 class TemperatureOutOfBounds(Exception):
     pass
@@ -18,6 +27,36 @@ class NotReachable(Exception):
     pass
 
 
+class NoRamp(Exception):
+    pass
+
+
+class TemperatureNotStable(Exception):
+    pass
+
+
+def bus_exception():
+    """
+    The exception that is raised for a failed device access. Importing the
+    device drivers is slow, therefore this is only done if an exception
+    has to be handled.
+    """
+    try:
+        from ben.devices import DLLException
+    except ImportError:
+        class DLLException(Exception):
+            pass
+    return DLLException
+
+
+def dim(text):
+    """
+    Formats text for the console such that it is less prominent.
+    """
+    from plumbum import colors
+    return colors.dim | text
+
+
 def line(x, m, t):
     return (m * x) + t
 
@@ -35,9 +74,8 @@ def in_range(value, range_):
 
 
 def fit_line(curr, freq):
-    [m, t], covariances = curve_fit(line, curr, freq)
-    m_err, t_err = np.sqrt(np.diag(covariances))
-    err = np.mean(np.abs([m_err / m, t_err / t]))
+    m, t, m_err, t_err = fit_lines(curr, freq)
+    err = relative_error(m, t, m_err, t_err)
 
     if m > 0:
         # slope has wrong sign --> mirror it
@@ -50,113 +88,183 @@ def find_current_for_frequency(freq, m, t):
     return (freq - t) / m
 
 
-def wait_for_stable_temperature(tec, tolerance=0.001):
-    sleep(0.05)
+def wait_for_stable_temperature(tec, tolerance=0.001,
+                                timeout=STABLE_TEMPERATURE_TIMEOUT,
+                                sleep=sleep, now=time, report=None):
+    """
+    Waits until the temperature of `tec` is within `tolerance` of its target.
+
+    The recent temperature trace is fitted with an exponential approach in
+    order to predict the remaining time. The TEC is polled rarely while far
+    away from the target and more often when getting close.
+    `report` is called with the predicted remaining time as soon as it can
+    be predicted, and then at most every `REPORT_INTERVAL` seconds.
+
+    Raises `TemperatureNotStable` if the temperature is not stable after
+    `timeout` seconds.
+    """
+    start = now()
+    deadline = start + timeout
+    target = None
+    times, diffs = [], []
+    bus_errors = 0
+    last_report = None
+
     while True:
         try:
-            while True:
-                diff = np.abs(
-                    (tec.get_temperature() - tec.get_target_temperature())
-                )
-                if diff < tolerance:
-                    break
-
-            break
-        except DLLException:
+            if target is None:
+                target = tec.get_target_temperature()
+            diff = tec.get_temperature() - target
+        except bus_exception():
+            bus_errors += 1
             print('Exception')
+            if bus_errors >= MAX_BUS_ERRORS:
+                raise
+            sleep(POLL_INTERVALS[0] * 2 ** bus_errors)
             continue
+        bus_errors = 0
 
+        if np.abs(diff) < tolerance:
+            return now() - start
 
-def find_negative_ramp(ramp):
-    new_slope = 0
-    start_idx = None
+        if now() > deadline:
+            raise TemperatureNotStable()
 
-    for idx, value in enumerate(ramp):
-        if idx == 0:
-            continue
+        times.append(now())
+        diffs.append(diff)
+        remaining = predict_settling_time(
+            times[-TEMPERATURE_TRACE_LENGTH:], diffs[-TEMPERATURE_TRACE_LENGTH:],
+            tolerance
+        )
 
-        old_slope = new_slope
-        new_slope = ramp[idx] - ramp[idx - 1]
+        if report is not None and remaining is not None and (
+            last_report is None or now() - last_report >= REPORT_INTERVAL
+        ):
+            last_report = now()
+            report(remaining)
 
-        if start_idx is None and old_slope > 0 and new_slope <= 0:
-            start_idx = idx
-
-        if start_idx is not None and old_slope < 0 and new_slope >= 0:
-            end_idx = idx
-            break
+        if remaining is None:
+            interval = POLL_INTERVALS[0]
+        else:
+            interval = np.clip(
+                POLL_FRACTION * remaining, POLL_INTERVALS[0], POLL_INTERVALS[1]
+            )
+        sleep(min(interval, max(deadline - now(), 0)))
 
-    return slice(start_idx, end_idx)
 
+def predict_settling_time(times, diffs, tolerance):
+    """
+    Fits `diff = A * exp(-t / tau)` to the trace of temperature differences
+    and returns the predicted time until `|diff| < tolerance`.
+    Returns None if the trace doesn't show an approach.
+    """
+    diffs = np.abs(diffs)
+    if len(diffs) < 3 or np.any(diffs == 0):
+        return
 
-def chunks(l, n):
-    """Yield successive n-sized chunks from l."""
-    for i in range(0, len(l), n):
-        yield l[i:i + n]
+    m, t, m_err, t_err = fit_lines(times, np.log(diffs))
+    if not m < 0:
+        return
 
+    return max((np.log(diffs[-1]) - np.log(tolerance)) / -m, 0)
 
-def split_to_chunks(curr, freq):
-    for split in range(1, 4):
 
-        if split != 1:
-            curr_intervals = chunks(curr, round(len(curr) / split))
-            freq_intervals = chunks(freq, round(len(freq) / split))
-        else:
-            curr_intervals, freq_intervals = [curr], [freq]
-
-        for curr_interval, freq_interval in zip(curr_intervals, freq_intervals):
-            if len(curr_interval) < 5:
-                continue
-
-            yield curr_interval, freq_interval
-
-
-def replay(target_frequencies, log, to_call=None):
-    for item in log:
-        if isinstance(item, tuple) or isinstance(item, list):
-            if len(item) == 2:
-                plt.plot(item[0], item[1])
-                plt.show(block=True)
-            else:
-                curr, freq, curr_interval, slope, shift = item
-                plot_ramp(
-                    target_frequencies,
-                    curr, freq, curr_interval, lambda x: line(x, slope, shift),
-                    to_call=to_call
-                )
-                plt.show(block=True)
-        else:
-            print(item)
+def print_remaining_time(remaining):
+    print('noch etwa %.1fs' % remaining)
 
 
-def plot_ramp(target_frequencies, curr, freq, curr_interval, fit, to_call=None):
+def wait_for_stable_frequency(read, sleep, now, max_duration, interval,
+                              tolerance=SETTLE_TOLERANCE, n_stable=1):
     """
-    Plot overview of current mode and extrapolated modes.
+    Repeatedly calls `read()` (which returns one or several frequencies)
+    until `n_stable` consecutive readings agree within `tolerance`, but at
+    most for `max_duration` seconds.
+
+    `sleep` and `now` are the clock functions of the electronics backend.
+    Returns the time that was spent waiting.
     """
-    linewidth = 3
-    palette = sns.color_palette()
-    x = np.linspace(*CURRENT_LIMITS)
-    plt.plot(x, [target_frequencies[0]/1e9] * len(x), color='black', linestyle='--', linewidth=linewidth)
-    plt.plot(x, [target_frequencies[1]/1e9] * len(x), color='black', linestyle='--', linewidth=linewidth)
-
-    for d in DELTA_MODES:
-        if d == 0:
-            color = palette[1]
+    start = now()
+    deadline = start + max_duration
+    last = None
+    stable_count = 0
+
+    while now() + interval < deadline:
+        sleep(interval)
+        reading = np.atleast_1d(np.asarray(read(), dtype=float))
+
+        if last is not None and \
+                np.median(np.abs(reading - last)) < tolerance:
+            stable_count += 1
+            if stable_count >= n_stable:
+                return now() - start
         else:
-            color = palette[0]
-        plt.plot(x, (fit(x) + d * MODE_FREQUENCY_SPACING) / 1e9, linestyle='dotted', color=color, alpha=1, linewidth=linewidth)
+            stable_count = 0
 
-    plt.plot(curr_interval, fit(np.array(curr_interval)) / 1e9, color=palette[1], linewidth=linewidth)
+        last = reading
 
-    #plt.plot(curr, freq, 'g')
+    # the remaining time is too short for another reading
+    sleep(max(deadline - now(), 0))
+    return now() - start
 
-    plt.ylim(
-        smaller(min(freq) / 1e9, (target_frequencies[0]) / 1e9) - 0,
-        greater(max(freq) / 1e9, (target_frequencies[1]) / 1e9) + 0,
+
+def find_ramps(ramp, hysteresis=None, lag=2):
+    """
+    Finds all complete flanks of a (noisy) triangle ramp.
+
+    The direction of each sample is determined from the difference to the
+    sample `lag` points later. Differences smaller than `hysteresis` are
+    considered noise and keep the previous direction. If no hysteresis is
+    given, it is estimated from the noise of the ramp.
+
+    Returns a list of `(slice, direction)` tuples with direction -1 for
+    falling and +1 for rising flanks. Flanks that are cut off by the start
+    or the end of the buffer are not returned.
+    """
+    ramp = np.asarray(ramp, dtype=float)
+    if len(ramp) <= 2 * lag:
+        return []
+
+    if hysteresis is None:
+        # robust noise estimate based on second differences
+        noise = np.median(np.abs(np.diff(ramp, 2))) / (0.6745 * np.sqrt(6))
+        hysteresis = 5 * noise
+
+    diff = ramp[lag:] - ramp[:-lag]
+    direction = np.sign(diff) * (np.abs(diff) > hysteresis)
+
+    # small differences inherit the direction of the previous sample
+    valid = np.flatnonzero(direction)
+    if not len(valid):
+        return []
+    fill_idx = np.maximum.accumulate(
+        np.where(direction != 0, np.arange(len(direction)), valid[0])
     )
+    direction = direction[fill_idx]
+
+    # the direction changes close to a turning point. The turning point
+    # itself is the extremum within `lag` samples.
+    changes = np.flatnonzero(np.diff(direction)) + 1
+    directions = direction[changes]
+    window = np.clip(
+        changes[:, None] + np.arange(-lag, lag + 1)[None, :], 0, len(ramp) - 1
+    )
+    values = ramp[window] * directions[:, None]
+    turns = window[np.arange(len(changes)), np.argmin(values, axis=1)]
+
+    return [
+        (slice(int(start), int(stop)), int(flank_direction))
+        for start, stop, flank_direction in zip(
+            turns[:-1], turns[1:], directions[:-1]
+        )
+    ]
 
-    plt.grid(True)
 
-    if to_call is not None:
-        to_call()
+def find_negative_ramp(ramp):
+    """
+    Returns a slice containing the first complete falling flank of `ramp`.
+    """
+    for slice_, direction in find_ramps(ramp):
+        if direction < 0:
+            return slice_
 
-    plt.show()
\ No newline at end of file
+    raise NoRamp()
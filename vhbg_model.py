@@ -0,0 +1,70 @@
+import numpy as np
+from config import TARGET_CURRENTS, MIN_TEMPERATURE, MAX_TEMPERATURE
+from fitting import fit_lines
+from utils import line
+
+# the model is only used if the observations span at least this range
+MIN_OBSERVATIONS = 3
+MIN_TEMPERATURE_SPAN = 0.2 # K
+# maximum relative uncertainty of the mode shift rate
+MAX_RELATIVE_ERROR = 0.5
+# the frequency of a mode is compared at this current
+REFERENCE_CURRENT = np.mean(TARGET_CURRENTS)
+
+
+class ModeShiftModel:
+    """
+    Learns how the laser frequency moves with the VHBG temperature from the
+    fits observed during a rough lock.
+
+    The frequency at a fixed current jumps with every mode hop, on average
+    it shifts by `rate` Hz/K. With this rate, the VHBG temperature that moves
+    the frequency to a desired value can be estimated.
+    """
+    def __init__(self):
+        self.temperatures = []
+        self.frequencies = []
+
+    def add(self, temperature, slope, shift):
+        """
+        Adds a fit of the current mode observed at VHBG `temperature`.
+        """
+        self.temperatures.append(temperature)
+        self.frequencies.append(line(REFERENCE_CURRENT, slope, shift))
+
+    def _fit(self, temperatures, values):
+        if len(temperatures) < MIN_OBSERVATIONS or \
+                np.ptp(temperatures) < MIN_TEMPERATURE_SPAN:
+            return
+
+        m, t, m_err, t_err = fit_lines(temperatures, values)
+        if not np.isfinite(m_err) or m == 0 or \
+                np.abs(m_err / m) > MAX_RELATIVE_ERROR:
+            return
+
+        return m, m_err
+
+    @property
+    def rate(self):
+        """
+        Mode shift rate and its uncertainty in Hz/K (or None).
+        """
+        return self._fit(self.temperatures, self.frequencies)
+
+    def target_temperature(self, temperature, frequency, target_frequency):
+        """
+        Estimates the VHBG temperature at which the laser, currently at
+        `frequency` for VHBG `temperature`, reaches `target_frequency`.
+
+        Returns the temperature and its uncertainty (or None).
+        """
+        rate = self.rate
+        if rate is None:
+            return
+
+        rate, rate_err = rate
+        delta = (target_frequency - frequency) / rate
+        band = np.abs(delta * rate_err / rate)
+        target = np.clip(temperature + delta, MIN_TEMPERATURE, MAX_TEMPERATURE)
+
+        return target, band
@@ -0,0 +1,35 @@
+class ElectronicsWrapper:
+    """
+    Base class for wrappers around an electronics backend, e.g. for
+    pipelining, caching, recording or tracing its calls.
+
+    Everything that isn't defined by the wrapper is taken from the backend.
+    Calls of public methods go through `_call`, except for the methods in
+    `NOT_WRAPPED`. Wrappers can be stacked.
+    """
+    # methods of the backend that are passed through unchanged
+    NOT_WRAPPED = frozenset()
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        attr = getattr(self.backend, name)
+
+        if name.startswith('_') or name in self.NOT_WRAPPED or \
+                not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return self._call(name, attr, args, kwargs)
+
+        return call
+
+    def _call(self, name, method, args, kwargs):
+        """
+        Calls `method` (the method `name` of the backend).
+        """
+        return method(*args, **kwargs)
+
+    def time(self):
+        return self.backend.time()